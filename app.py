@@ -1,9 +1,7 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-import smtplib
-from email.mime.text import MIMEText
 from models import db, User
-import os
+from database import configure_database
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,38 +10,17 @@ app = Flask(__name__)
 
 # Application configuration
 app.config["SECRET_KEY"] = "thisdoesntmeananything"  
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///database.db"  
+configure_database(app)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False 
 
 db = SQLAlchemy(app)
-# Gmail SMTP email sending function
-def send_email(recipient_email, subject, body):
-    smtp_server = "smtp.gmail.com"
-    smtp_port = 587
-    smtp_username = os.environ.get("GMAIL_USER")
-    smtp_password = os.environ.get("GMAIL_APP_PASSWORD")
-    sender_email = smtp_username
-
-    msg = MIMEText(body)
-    msg["Subject"] = subject
-    msg["From"] = sender_email
-    msg["To"] = recipient_email
-
-    try:
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.sendmail(sender_email, [recipient_email], msg.as_string())
-        return True
-    except Exception as e:
-        print(f"Email send failed: {e}")
-        return False
 
 from routes import app, db  
+from migrations import upgrade_database
 
 # Create database tables and setup default users
 with app.app_context():
-    db.create_all()
+    upgrade_database()
 
     # List of default users 
     # I've created a superuser
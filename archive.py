@@ -0,0 +1,232 @@
+import base64
+import io
+import json
+import os
+import tarfile
+from datetime import datetime
+
+from sqlalchemy import insert, select, union
+
+from database import read_snapshot
+from models import db, ArtistStats, Comment, Follower, Image, ImageHashBand, ImageRendition, UniqueNumberCounter, User, Vote
+from search import create_search_index, drop_search_index
+
+
+# Identifies catalog archives and the version of their layout
+ARCHIVE_FORMAT = "imageshare-catalog"
+ARCHIVE_VERSION = 1
+
+# Tables copied by an archive, in an order that satisfies their foreign keys.
+# Caches and the email outbox are left out; the search index is rebuilt on import.
+ARCHIVE_MODELS = [User, Image, ImageRendition, ImageHashBand, Vote, Comment, Follower, ArtistStats, UniqueNumberCounter]
+
+# A chunk is closed at this many rows or bytes, whichever comes first, bounding memory on both sides
+CHUNK_MAX_BYTES = 64 * 1024 * 1024
+
+
+# Python type of a column, or None when the type does not say
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+# Converts a row to JSON-safe values: datetimes as ISO 8601, bytes as base64
+def _encode_row(row):
+    encoded = {}
+    for name, value in row.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, bytes):
+            value = base64.b64encode(value).decode("ascii")
+        encoded[name] = value
+    return encoded
+
+
+# Reverses _encode_row using the column types, dropping columns the table does not have
+def _decoder(table):
+    types = {column.name: _python_type(column) for column in table.columns}
+
+    def decode(row):
+        decoded = {}
+        for name, value in row.items():
+            if name not in types:
+                continue
+            if value is not None and types[name] is datetime:
+                value = datetime.fromisoformat(value)
+            elif value is not None and types[name] is bytes:
+                value = base64.b64decode(value)
+            decoded[name] = value
+        return decoded
+
+    return decode
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(datetime.utcnow().timestamp())
+    tar.addfile(info, io.BytesIO(data))
+
+
+# Streams a table in primary-key order through a server-side cursor and yields NDJSON chunks
+def _table_chunks(connection, table, chunk_rows):
+    result = connection.execution_options(yield_per=min(chunk_rows, 1000)).execute(
+        select(table).order_by(*table.primary_key.columns)
+    )
+    chunk, rows = io.BytesIO(), 0
+    for row in result.mappings():
+        chunk.write(json.dumps(_encode_row(row), separators=(",", ":")).encode("utf-8") + b"\n")
+        rows += 1
+        if rows >= chunk_rows or chunk.tell() >= CHUNK_MAX_BYTES:
+            yield chunk.getvalue(), rows
+            chunk, rows = io.BytesIO(), 0
+    if rows:
+        yield chunk.getvalue(), rows
+
+
+# Every blob the archived rows refer to, each digest once
+def _referenced_blobs():
+    return union(
+        select(Image.content_hash.label("digest")).where(Image.content_hash.isnot(None)),
+        select(Image.original_hash).where(Image.original_hash.isnot(None)),
+        select(Image.qr_hash).where(Image.qr_hash.isnot(None)),
+        select(ImageRendition.content_hash),
+    )
+
+
+def write_archive(fileobj, store, chunk_rows=50000, compress=False, progress=print):
+    """
+    Streams the catalog into a tar archive.
+
+    The archive holds a manifest, then each table as numbered NDJSON chunks
+    (tables/<table>/<n>.ndjson), then every referenced blob (blobs/<digest>).
+    Rows are read through server-side cursors in primary-key order and blobs
+    are copied straight from their files, so memory stays bounded by one
+    chunk however large the tables are. Everything is read from one
+    snapshot (see database.read_snapshot), so tables and blobs agree even
+    while the app keeps writing, and the export never blocks those writes.
+
+    Args:
+        fileobj: Binary file object to write to; it only needs write().
+        store (BlobStore): Where the image blobs are read from.
+        chunk_rows (int): Most rows per chunk.
+        compress (bool): Gzip the archive.
+        progress (callable): Called with a message after each chunk.
+
+    Returns:
+        dict: Rows written per table, and the number of blobs.
+    """
+    counts = {}
+    with tarfile.open(fileobj=fileobj, mode="w|gz" if compress else "w|") as tar, \
+            read_snapshot(db) as connection:
+        tables = [model.__table__ for model in ARCHIVE_MODELS]
+        manifest = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION,
+                    "created_at": datetime.utcnow().isoformat(), "tables": [table.name for table in tables]}
+        _add_bytes(tar, "manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+
+        for table in tables:
+            counts[table.name] = 0
+            for number, (data, rows) in enumerate(_table_chunks(connection, table, chunk_rows)):
+                _add_bytes(tar, f"tables/{table.name}/{number:06d}.ndjson", data)
+                counts[table.name] += rows
+                progress(f"Exported {counts[table.name]} rows of {table.name}")
+
+        counts["blobs"] = 0
+        for digest in connection.execution_options(yield_per=1000).execute(_referenced_blobs()).scalars():
+            if not store.exists(digest):
+                progress(f"Skipped blob {digest}, it is missing from the blob store")
+                continue
+            with store.open(digest) as blob:
+                info = tarfile.TarInfo(f"blobs/{digest}")
+                info.size = os.fstat(blob.fileno()).st_size
+                tar.addfile(info, blob)
+            counts["blobs"] += 1
+            if counts["blobs"] % 1000 == 0:
+                progress(f"Exported {counts['blobs']} blobs")
+    return counts
+
+
+# Empties the archived tables, dependants first, so the archive can be loaded with its own ids
+def _clear_tables(connection):
+    for model in reversed(ARCHIVE_MODELS):
+        connection.execute(model.__table__.delete())
+
+
+# Moves PostgreSQL id sequences past the imported ids
+def _reset_sequences(connection):
+    for model in ARCHIVE_MODELS:
+        table = model.__table__
+        if "id" in table.columns and table.columns["id"].autoincrement:
+            connection.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 0) + 1, false)"
+            )
+
+
+def read_archive(fileobj, store, progress=print):
+    """
+    Replaces the catalog with the contents of an archive made by write_archive.
+
+    The archive is read as a stream, one member at a time. The archived
+    tables are emptied first, then every chunk is inserted with a single
+    executemany in its own transaction, so memory and transaction size stay
+    bounded by one chunk. Blobs are written to the blob store as they come.
+    On SQLite the search index is dropped while rows load and rebuilt once
+    at the end, instead of being updated by triggers for every row.
+
+    Args:
+        fileobj: Binary file object to read from; it only needs read().
+        store (BlobStore): Where the image blobs are written.
+        progress (callable): Called with a message after each chunk.
+
+    Returns:
+        dict: Rows read per table, and the number of blobs.
+
+    Raises:
+        ValueError: If the file is not a catalog archive this version can read.
+    """
+    tables = {model.__table__.name: model.__table__ for model in ARCHIVE_MODELS}
+    sqlite = db.engine.dialect.name == "sqlite"
+    counts = {}
+
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        members = iter(tar)
+        first = next(members, None)
+        manifest = json.load(tar.extractfile(first)) if first and first.name == "manifest.json" else {}
+        if manifest.get("format") != ARCHIVE_FORMAT or manifest.get("version") != ARCHIVE_VERSION:
+            raise ValueError("Not a catalog archive, or made by an incompatible version.")
+
+        with db.engine.begin() as connection:
+            if sqlite:
+                drop_search_index(connection)
+            _clear_tables(connection)
+
+        decoders = {name: _decoder(table) for name, table in tables.items()}
+        for member in members:
+            if not member.isfile():
+                continue
+            parts = member.name.split("/")
+            data = tar.extractfile(member).read()
+
+            if parts[0] == "blobs":
+                store.put(data)
+                counts["blobs"] = counts.get("blobs", 0) + 1
+                if counts["blobs"] % 1000 == 0:
+                    progress(f"Imported {counts['blobs']} blobs")
+            elif parts[0] == "tables" and parts[1] in tables:
+                decode = decoders[parts[1]]
+                rows = [decode(json.loads(line)) for line in data.split(b"\n") if line]
+                if rows:
+                    with db.engine.begin() as connection:
+                        connection.execute(insert(tables[parts[1]]), rows)
+                counts[parts[1]] = counts.get(parts[1], 0) + len(rows)
+                progress(f"Imported {counts[parts[1]]} rows of {parts[1]}")
+
+    with db.engine.begin() as connection:
+        if sqlite:
+            create_search_index(connection)
+        else:
+            _reset_sequences(connection)
+    return counts
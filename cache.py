@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from moderation import CATEGORIES
+
+
+class CacheBackend:
+    """
+    Base class for fragment cache storage.
+
+    A backend stores rendered fragments under string keys for a limited time
+    and keeps a generation number per tag. Bumping a tag's generation is how
+    fragments are invalidated: fragment keys embed the generations of their
+    tags, so old entries are simply never looked up again and age out.
+    """
+
+    def get(self, key):
+        """Returns the stored fragment, or None if it is missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Stores a fragment for ttl seconds."""
+        raise NotImplementedError
+
+    def generations(self, tags):
+        """Returns the current generation of each tag, 0 for tags never bumped."""
+        raise NotImplementedError
+
+    def bump(self, tags):
+        """Advances the generation of each tag."""
+        raise NotImplementedError
+
+    def size(self):
+        """Returns the number of stored fragments."""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Keeps fragments in this process, in an LRU map bounded to max_entries.
+
+    Generations are per process too, so with several worker processes an
+    invalidation only reaches the process that made it; the others catch up
+    when their entries expire. Use the sqlite backend to share invalidations.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at), least recently used first
+        self._generations = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Keeps fragments in a SQLite file shared by every process on the host.
+
+    Invalidations made by one worker process are seen by all of them. The
+    file is a throwaway cache, separate from the app database, so its writes
+    never contend with uploads or votes. When it holds more than max_entries
+    fragments, those closest to expiry are evicted first.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS fragment (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS ix_fragment_expires ON fragment (expires_at);
+                CREATE TABLE IF NOT EXISTS generation (tag TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            """)
+
+    # One connection per thread; autocommit, so every statement is its own short transaction
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM fragment WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO fragment (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, value, time.time() + ttl))
+        conn.execute("DELETE FROM fragment WHERE expires_at <= ?", (time.time(),))
+        conn.execute("""
+            DELETE FROM fragment WHERE key IN (
+                SELECT key FROM fragment ORDER BY expires_at
+                LIMIT max(0, (SELECT count(*) FROM fragment) - ?)
+            )
+        """, (self.max_entries,))
+
+    def generations(self, tags):
+        rows = dict(self._connection().execute(
+            f"SELECT tag, value FROM generation WHERE tag IN ({', '.join('?' * len(tags))})", tags
+        ).fetchall())
+        return [rows.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        self._connection().executemany(
+            "INSERT INTO generation (tag, value) VALUES (?, 1) "
+            "ON CONFLICT (tag) DO UPDATE SET value = value + 1",
+            [(tag,) for tag in tags],
+        )
+
+    def size(self):
+        return self._connection().execute("SELECT count(*) FROM fragment").fetchone()[0]
+
+
+class FragmentCache:
+    """
+    Caches rendered template fragments and counts hits and misses.
+
+    Each fragment is stored with the tags of the data it shows; invalidating
+    a tag makes every fragment carrying it miss from then on, however long
+    its TTL. Hit and miss counts are kept per process.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_render(self, key, tags, render):
+        """
+        Returns the cached fragment for key, rendering and storing it on a miss.
+
+        Args:
+            key (str): Identifies the fragment, e.g. the route and its arguments.
+            tags (list): Tags of the data the fragment shows.
+            render (callable): Renders the fragment as a string.
+
+        Returns:
+            str: The rendered fragment.
+        """
+        generations = self.backend.generations(tags)
+        versioned_key = f"{key}@{'.'.join(map(str, generations))}"
+
+        value = self.backend.get(versioned_key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = render()
+            self.backend.set(versioned_key, value, self.ttl)
+        return value
+
+    def invalidate(self, *tags):
+        """Makes every fragment carrying any of the tags stale."""
+        if tags:
+            self.backend.bump(list(tags))
+            with self._lock:
+                self.invalidations += 1
+
+    def stats(self):
+        """Returns the hit and miss counts of this process and the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations,
+                "entries": self.backend.size(),
+            }
+
+
+def init_fragment_cache(app):
+    """
+    Creates the configured fragment cache and attaches it to the app.
+
+    Settings:
+        FRAGMENT_CACHE_ENABLED: Cache rendered fragments at all.
+        FRAGMENT_CACHE_BACKEND: "memory" (per process) or "sqlite" (shared
+            by the processes on one host through FRAGMENT_CACHE_PATH).
+        FRAGMENT_CACHE_TTL: Seconds a fragment is served before it is
+            rendered again, bounding how stale vote-based orderings get.
+        FRAGMENT_CACHE_MAX_ENTRIES: Fragments kept before the oldest are evicted.
+    """
+    app.config.setdefault("FRAGMENT_CACHE_ENABLED", True)
+    app.config.setdefault("FRAGMENT_CACHE_BACKEND", "memory")
+    app.config.setdefault("FRAGMENT_CACHE_PATH", os.path.join(app.instance_path, "fragment_cache.db"))
+    app.config.setdefault("FRAGMENT_CACHE_TTL", 60)
+    app.config.setdefault("FRAGMENT_CACHE_MAX_ENTRIES", 512)
+
+    if app.config["FRAGMENT_CACHE_BACKEND"] == "sqlite":
+        backend = SQLiteCacheBackend(app.config["FRAGMENT_CACHE_PATH"], app.config["FRAGMENT_CACHE_MAX_ENTRIES"])
+    else:
+        backend = MemoryCacheBackend(app.config["FRAGMENT_CACHE_MAX_ENTRIES"])
+    app.extensions["fragment_cache"] = FragmentCache(backend, app.config["FRAGMENT_CACHE_TTL"])
+
+
+def get_fragment_cache():
+    """Returns the fragment cache of the current application, or None if caching is disabled."""
+    if not current_app.config["FRAGMENT_CACHE_ENABLED"]:
+        return None
+    return current_app.extensions["fragment_cache"]
+
+
+# Tag of the guest listing of one category, or of all categories for "all"
+def listing_tag(category):
+    return f"listing:{category}"
+
+
+def invalidate_listings(*categories):
+    """
+    Invalidates the cached guest listings that show images of the given
+    categories, or every listing when no category is given.
+    """
+    cache = get_fragment_cache()
+    if cache is not None:
+        cache.invalidate(listing_tag("all"), *(listing_tag(category) for category in set(categories or CATEGORIES)))
@@ -0,0 +1,241 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import update
+
+from archive import read_archive, write_archive
+from duplicates import find_duplicate, index_image_hash
+from follows import recount_follow_counts
+from imaging import ImageRejected, hash_image_data
+from mailer import SMTPConnection, send_due_emails
+from models import db, ArtistStats, Image
+from search import rebuild_search_index
+from stats import rebuild_artist_stats
+from storage import get_blob_store
+
+
+@click.command("migrate-blobs")
+@click.option("--batch-size", default=200, show_default=True, help="Images moved per transaction.")
+@click.option("--vacuum", is_flag=True, help="Run VACUUM afterwards to shrink the database file.")
+@with_appcontext
+def migrate_blobs(batch_size, vacuum):
+    """
+    Moves inline image data from the database into the blob store.
+
+    Rows are processed in primary-key order, one batch per transaction, so
+    only a single batch of image bytes is held in memory at a time and the
+    command can be interrupted and re-run safely.
+    """
+    store = get_blob_store()
+    last_id = 0
+    moved = 0
+
+    while True:
+        rows = (
+            db.session.query(Image.id, Image.image_data)
+            .filter(Image.id > last_id, Image.content_hash.is_(None), Image.image_data.isnot(None))
+            .order_by(Image.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        updates = []
+        for image_id, image_data in rows:
+            digest, size = store.put(image_data)
+            updates.append({"id": image_id, "content_hash": digest, "content_size": size, "image_data": None})
+
+        db.session.execute(update(Image), updates)
+        db.session.commit()
+
+        last_id = rows[-1].id
+        moved += len(rows)
+        click.echo(f"Moved {moved} images to the blob store")
+
+    if vacuum:
+        db.session.close()
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql("VACUUM")
+    click.echo(f"Done, {moved} images moved.")
+
+
+@click.command("repair-follow-counts")
+@with_appcontext
+def repair_follow_counts():
+    """
+    Recomputes every user's follower and following counters.
+
+    The counters are kept up to date by follow and unfollow; this rebuilds
+    them from the follower table in one statement, e.g. after follows were
+    edited directly in the database.
+    """
+    updated = db.session.execute(recount_follow_counts()).rowcount
+    db.session.commit()
+    click.echo(f"Recounted follows of {updated} users.")
+
+
+@click.command("rebuild-artist-stats")
+@with_appcontext
+def rebuild_artist_stats_command():
+    """
+    Recomputes the stats of every artist from their approved images.
+
+    The stats are kept up to date by voting and moderation; this rebuilds
+    them in a single transaction, e.g. to backfill them or after images
+    were edited directly in the database.
+    """
+    rebuild_artist_stats(db.session)
+    db.session.commit()
+    click.echo(f"Rebuilt stats of {db.session.query(ArtistStats).count()} artists.")
+
+
+@click.command("rebuild-search-index")
+@with_appcontext
+def rebuild_search_index_command():
+    """
+    Refills the full-text search index from the images, users and comments.
+
+    Triggers keep the index in sync; this is only needed if the tables were
+    changed with the triggers missing, e.g. restored from a backup.
+    """
+    with db.engine.begin() as conn:
+        rebuild_search_index(conn)
+    click.echo("Rebuilt the search index.")
+
+
+@click.command("hash-images")
+@click.option("--batch-size", default=200, show_default=True, help="Images hashed per transaction.")
+@with_appcontext
+def hash_images(batch_size):
+    """
+    Computes perceptual hashes of images uploaded before they were hashed.
+
+    Images are processed in upload order and each is compared with those
+    hashed before it, so later copies of an image are flagged as possible
+    duplicates of the first. Safe to interrupt and re-run.
+    """
+    store = get_blob_store()
+    max_distance = current_app.config["DUPLICATE_MAX_DISTANCE"]
+    last_id = 0
+    hashed = flagged = 0
+
+    while True:
+        rows = (
+            db.session.query(Image.id, Image.original_hash, Image.content_hash)
+            .filter(Image.id > last_id, Image.phash.is_(None))
+            .order_by(Image.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        for image_id, original_hash, content_hash in rows:
+            # Hash the file as uploaded if it was kept, else the stored image
+            digest = original_hash or content_hash
+            if digest:
+                with store.open(digest) as blob:
+                    data = blob.read()
+            else:
+                data = db.session.query(Image.image_data).filter(Image.id == image_id).scalar()
+            try:
+                phash = hash_image_data(data)
+            except ImageRejected:
+                click.echo(f"Skipped image {image_id}, its data could not be decoded")
+                continue
+
+            duplicate = find_duplicate(phash, max_distance)
+            db.session.execute(
+                update(Image).where(Image.id == image_id)
+                .values(phash=phash, duplicate_of_id=duplicate.image_id if duplicate else None)
+            )
+            index_image_hash(image_id, phash)
+            hashed += 1
+            flagged += duplicate is not None
+
+        db.session.commit()
+        last_id = rows[-1].id
+        click.echo(f"Hashed {hashed} images")
+
+    click.echo(f"Done, {hashed} images hashed, {flagged} flagged as possible duplicates.")
+
+
+@click.command("export-catalog")
+@click.argument("path")
+@click.option("--chunk-rows", default=50000, show_default=True, help="Most rows per NDJSON chunk.")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the archive.")
+@with_appcontext
+def export_catalog(path, chunk_rows, compress):
+    """
+    Streams users, images, votes, comments, follows and image blobs into
+    a tar archive at PATH ("-" for standard output).
+
+    Safe to run while the app is up: everything is read from one snapshot
+    without blocking writes, in constant memory. See archive.py for the layout.
+    """
+    with click.open_file(path, "wb") as fileobj:
+        counts = write_archive(fileobj, get_blob_store(), chunk_rows=chunk_rows, compress=compress,
+                               progress=lambda message: click.echo(message, err=True))
+    click.echo(f"Done, exported {_describe_counts(counts)}.", err=True)
+
+
+@click.command("import-catalog")
+@click.argument("path")
+@click.confirmation_option(prompt="This replaces every user, image, vote, comment and follow. Continue?")
+@with_appcontext
+def import_catalog(path):
+    """
+    Replaces the catalog with an archive made by export-catalog, read from
+    PATH ("-" for standard input; gzipped archives are detected).
+
+    Each chunk is inserted with one executemany in its own transaction.
+    Stop the app first: the tables are emptied before the rows are loaded.
+    """
+    with click.open_file(path, "rb") as fileobj:
+        try:
+            counts = read_archive(fileobj, get_blob_store(),
+                                  progress=lambda message: click.echo(message, err=True))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Done, imported {_describe_counts(counts)}.", err=True)
+
+
+# Formats the rows and blobs counted by an export or import for the summary line
+def _describe_counts(counts):
+    return ", ".join(f"{count} {name}" for name, count in counts.items())
+
+
+@click.command("send-outbox")
+@with_appcontext
+def send_outbox():
+    """
+    Sends every email in the outbox that is due now.
+
+    Uses the same claims as the background sender, so it is safe to run
+    while the app is up, e.g. from cron when MAIL_SENDER_ENABLED is off.
+    Failed emails are scheduled for a retry as usual.
+    """
+    connection = SMTPConnection(current_app.config)
+    claimed = 0
+    try:
+        while True:
+            batch = send_due_emails(connection, current_app.config)
+            if not batch:
+                break
+            claimed += batch
+    finally:
+        connection.close()
+    click.echo(f"Tried {claimed} emails.")
+
+
+# Registers the maintenance commands with the Flask CLI
+def register_commands(app):
+    app.cli.add_command(migrate_blobs)
+    app.cli.add_command(repair_follow_counts)
+    app.cli.add_command(rebuild_artist_stats_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(hash_images)
+    app.cli.add_command(send_outbox)
+    app.cli.add_command(export_catalog)
+    app.cli.add_command(import_catalog)
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+# Used when the DATABASE_URL environment variable is not set
+DEFAULT_DATABASE_URI = "sqlite:///database.db"
+
+# Bind key of the read-only engine used when reads and writes are split
+READER_BIND = "reader"
+
+
+def configure_database(app):
+    """
+    Sets the database settings of an app, leaving values it already has.
+
+    Settings:
+        SQLITE_BUSY_TIMEOUT_MS: How long a connection waits for a lock before
+            failing with "database is locked".
+        SQLITE_MMAP_SIZE: Bytes of the database file read through mmap.
+        SQLITE_CACHE_SIZE_KB: Page cache size per connection, in KiB.
+        SQLITE_READ_WRITE_SPLIT: Send reads to a separate pool of read-only
+            connections, and start write transactions with BEGIN IMMEDIATE.
+        SQLITE_READER_POOL_SIZE: Connections in the reader pool.
+    """
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URI))
+    app.config.setdefault("SQLITE_BUSY_TIMEOUT_MS", 5000)
+    app.config.setdefault("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+    app.config.setdefault("SQLITE_CACHE_SIZE_KB", 64 * 1024)
+    app.config.setdefault("SQLITE_READ_WRITE_SPLIT", os.environ.get("SQLITE_READ_WRITE_SPLIT") == "1")
+    app.config.setdefault("SQLITE_READER_POOL_SIZE", 10)
+
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if app.config["SQLITE_READ_WRITE_SPLIT"] and uri.startswith("sqlite"):
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        binds.setdefault(READER_BIND, {"url": uri, "pool_size": app.config["SQLITE_READER_POOL_SIZE"]})
+
+
+def init_database(app, db):
+    """
+    Initialises the database extension and tunes every SQLite connection.
+
+    Each new connection gets WAL journaling, so readers never block on the
+    writer, synchronous=NORMAL (safe with WAL), a busy timeout, mmap and a
+    larger page cache. Reader connections are additionally query-only.
+    """
+    configure_database(app)
+    db.init_app(app)
+
+    with app.app_context():
+        engines = db.engines
+
+    split = READER_BIND in engines
+    for bind_key, engine in engines.items():
+        if engine.dialect.name != "sqlite":
+            continue
+        reader = bind_key == READER_BIND
+        event.listen(engine, "connect", _sqlite_pragmas(app.config, reader=reader))
+        if split and not reader:
+            _begin_immediate(engine)
+
+
+def _sqlite_pragmas(config, reader):
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        if not reader:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+        cursor.execute(f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}")
+        if reader:
+            cursor.execute("PRAGMA query_only=1")
+        cursor.close()
+    return set_pragmas
+
+
+# Writer transactions take the write lock up front instead of upgrading a read
+# lock mid-transaction, which SQLite cannot wait for and fails with SQLITE_BUSY
+def _begin_immediate(engine):
+    @event.listens_for(engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin_immediate(conn):
+        if conn.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def insert_if_absent(engine, model, index_elements, **values):
+    """
+    Builds an INSERT of one row that does nothing when the row would
+    violate the unique index on index_elements (ON CONFLICT DO NOTHING on
+    SQLite and PostgreSQL). The result's rowcount says whether it inserted.
+
+    Args:
+        engine (Engine): The engine the statement will run on, for its dialect.
+        model: The mapped class to insert into.
+        index_elements (list): Columns of the unique index that may conflict.
+        **values: The row's column values.
+
+    Returns:
+        Insert: The statement.
+    """
+    dialect = sqlite if engine.dialect.name == "sqlite" else postgresql
+    return dialect.insert(model).values(**values).on_conflict_do_nothing(index_elements=index_elements)
+
+
+@contextmanager
+def read_snapshot(db):
+    """
+    Opens a connection whose reads all see one consistent snapshot, without
+    holding the write lock.
+
+    pysqlite sends no BEGIN before a SELECT, so each statement on a plain
+    connection would see the latest commit. On SQLite the connection runs in
+    driver autocommit mode and issues an explicit deferred BEGIN instead; in
+    WAL mode that read transaction never blocks writers. The reader engine is
+    used when reads and writes are split, so BEGIN IMMEDIATE is never sent.
+    Other databases read in a REPEATABLE READ transaction.
+
+    Args:
+        db (SQLAlchemy): The database extension.
+
+    Yields:
+        Connection: The connection to read from.
+    """
+    engine = db.engines.get(READER_BIND) or db.engine
+    if engine.dialect.name != "sqlite":
+        with engine.connect().execution_options(isolation_level="REPEATABLE READ") as connection, \
+                connection.begin():
+            yield connection
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("BEGIN")
+        try:
+            yield connection
+        finally:
+            connection.exec_driver_sql("ROLLBACK")
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to the reader engine when one is configured.
+
+    Statements run on the writer once the current transaction has written
+    anything, so a request always reads its own uncommitted changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and clause is not None and getattr(clause, "is_select", False) and not self._has_written():
+            reader = self._db.engines.get(READER_BIND)
+            if reader is not None:
+                return reader
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _has_written(self):
+        return bool(self.info.get("has_written") or self.new or self.dirty or self.deleted)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _track_writes(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["has_written"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _track_flush(session, flush_context):
+    session.info["has_written"] = True
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_writes(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("has_written", None)
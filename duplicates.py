@@ -0,0 +1,74 @@
+from collections import namedtuple
+
+from sqlalchemy import insert, or_, select
+
+from models import db, Image, ImageHashBand
+
+
+# Perceptual hashes are split into this many bands of BAND_BITS bits each
+HASH_BANDS = 4
+BAND_BITS = 16
+
+# A near-duplicate found for a hash, and how many of the 64 bits differ
+DuplicateMatch = namedtuple("DuplicateMatch", ["image_id", "distance"])
+
+
+def hash_bands(phash):
+    """Splits a hex perceptual hash into its (band, value) pairs."""
+    value = int(phash, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(band, (value >> (band * BAND_BITS)) & mask) for band in range(HASH_BANDS)]
+
+
+def hamming_distance(phash, other):
+    """Returns the number of bits that differ between two hex perceptual hashes."""
+    return bin(int(phash, 16) ^ int(other, 16)).count("1")
+
+
+def find_duplicate(phash, max_distance):
+    """
+    Finds the stored image whose perceptual hash is closest to phash.
+
+    Uses multi-index hashing: if two 64-bit hashes differ in fewer bits than
+    there are bands, at least one of their four 16-bit bands is identical.
+    So only images sharing a band, found with one lookup per band on the
+    image_hash_band primary key, are compared bit by bit. The number of
+    candidates depends on how many images share a band, not on the size of
+    the catalog.
+
+    Args:
+        phash (str): The hex hash to look up.
+        max_distance (int): Largest Hamming distance counted as a duplicate;
+            must be less than HASH_BANDS.
+
+    Returns:
+        DuplicateMatch: The closest match, the earliest on ties, or None.
+    """
+    if max_distance >= HASH_BANDS:
+        raise ValueError(f"max_distance must be less than {HASH_BANDS}")
+
+    band_matches = [
+        (ImageHashBand.band == band) & (ImageHashBand.value == value)
+        for band, value in hash_bands(phash)
+    ]
+    candidates = db.session.execute(
+        select(Image.id, Image.phash)
+        .join(ImageHashBand, ImageHashBand.image_id == Image.id)
+        .where(or_(*band_matches))
+        .distinct()
+    ).all()
+
+    matches = [
+        DuplicateMatch(image_id, hamming_distance(phash, candidate))
+        for image_id, candidate in candidates
+    ]
+    matches = [match for match in matches if match.distance <= max_distance]
+    return min(matches, key=lambda match: (match.distance, match.image_id), default=None)
+
+
+def index_image_hash(image_id, phash):
+    """Adds an image's hash bands to the lookup table. Does not commit."""
+    db.session.execute(
+        insert(ImageHashBand),
+        [{"band": band, "value": value, "image_id": image_id} for band, value in hash_bands(phash)],
+    )
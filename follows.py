@@ -0,0 +1,64 @@
+from sqlalchemy import delete, func, select, update
+
+from database import insert_if_absent
+from models import db, User, Follower
+
+
+# Adds delta to both users' counters of a follow relationship
+def _add_to_follow_counts(follower_id, followed_id, delta):
+    db.session.execute(
+        update(User).where(User.id == followed_id).values(follower_count=User.follower_count + delta),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.execute(
+        update(User).where(User.id == follower_id).values(following_count=User.following_count + delta),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def follow(follower_id, followed_id):
+    """
+    Makes one user follow another and adjusts both users' counters.
+
+    The insert is skipped when the relationship already exists, and the
+    counters only change when a row was actually inserted, so repeated or
+    concurrent requests can neither duplicate the row nor inflate the
+    counts. Does not commit.
+
+    Returns:
+        bool: True if the user was not following before.
+    """
+    inserted = db.session.execute(insert_if_absent(
+        db.engine, Follower, ["follower_id", "followed_id"], follower_id=follower_id, followed_id=followed_id,
+    )).rowcount
+    if inserted:
+        _add_to_follow_counts(follower_id, followed_id, 1)
+    return bool(inserted)
+
+
+def unfollow(follower_id, followed_id):
+    """
+    Removes a follow relationship and adjusts both users' counters.
+    Does not commit.
+
+    Returns:
+        bool: True if the user was following before.
+    """
+    removed = db.session.execute(
+        delete(Follower).where(Follower.follower_id == follower_id, Follower.followed_id == followed_id),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if removed:
+        _add_to_follow_counts(follower_id, followed_id, -1)
+    return bool(removed)
+
+
+def recount_follow_counts():
+    """
+    Builds an UPDATE that recomputes every user's follower and following
+    counters from the follower table, in a single statement.
+    """
+    return update(User).values(
+        follower_count=select(func.count()).where(Follower.followed_id == User.id).scalar_subquery(),
+        following_count=select(func.count()).where(Follower.follower_id == User.id).scalar_subquery(),
+    )
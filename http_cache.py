@@ -0,0 +1,49 @@
+from flask import Response, request
+from werkzeug.http import is_resource_modified
+
+
+def is_not_modified(etag=None, last_modified=None):
+    """
+    Checks the request's If-None-Match and If-Modified-Since headers.
+
+    Args:
+        etag (str): Strong ETag of the current representation, if known.
+        last_modified (datetime): When the representation last changed, if known.
+
+    Returns:
+        bool: True if the client's cached copy is still current.
+    """
+    if etag is None and last_modified is None:
+        return False
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def set_cache_headers(response, etag=None, last_modified=None, max_age=0, immutable=False):
+    """
+    Adds validators and a public Cache-Control header to a response.
+
+    Args:
+        response (Response): The response to update.
+        etag (str): Strong ETag for the representation.
+        last_modified (datetime): When the representation last changed.
+        max_age (int): How long clients may reuse the response, in seconds.
+        immutable (bool): Whether the content at this URL never changes.
+
+    Returns:
+        Response: The same response, for chaining.
+    """
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+def not_modified_response(etag=None, last_modified=None, max_age=0, immutable=False):
+    """Builds an empty 304 Not Modified response carrying the same cache headers."""
+    return set_cache_headers(Response(status=304), etag, last_modified, max_age, immutable)
@@ -0,0 +1,163 @@
+from collections import namedtuple
+from io import BytesIO
+
+import qrcode
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError
+
+
+# Size of the stored thumbnail
+THUMBNAIL_SIZE = (64, 64)
+
+# Pillow encoder names and settings for each rendition format
+RENDITION_ENCODERS = {
+    "avif": ("AVIF", {"quality": 60}),
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "png": ("PNG", {}),
+}
+
+# Content types of the rendition formats
+RENDITION_MIMETYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "png": "image/png",
+}
+
+
+class ImageRejected(ValueError):
+    """Raised when an uploaded file cannot be accepted as an image."""
+
+
+# Result of processing an upload: the PNG thumbnail, the decoder's name for the
+# uploaded format, a list of (size, format, bytes) renditions and the perceptual hash
+ProcessedUpload = namedtuple("ProcessedUpload", ["thumbnail", "original_format", "renditions", "phash"])
+
+
+def _encode(img, fmt):
+    encoder, options = RENDITION_ENCODERS[fmt]
+    img_io = BytesIO()
+    img.save(img_io, format=encoder, **options)
+    return img_io.getvalue()
+
+
+def difference_hash(img):
+    """
+    Computes the 64-bit difference hash (dHash) of an image.
+
+    The image is reduced to 9x8 grey pixels and each bit records whether a
+    pixel is brighter than its right-hand neighbour. Resizing, re-encoding
+    and small edits change only a few bits, so near-duplicates have hashes
+    a small Hamming distance apart.
+
+    Returns:
+        str: The hash as 16 hex digits.
+    """
+    small = img.convert("L").resize((9, 8), PILImage.LANCZOS)
+    pixels = small.tobytes()  # One byte per grey pixel, row by row
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{value:016x}"
+
+
+def hash_image_data(data):
+    """
+    Computes the difference hash of encoded image bytes, for images stored
+    before hashes were computed at upload.
+
+    Raises:
+        ImageRejected: If the data is not a readable image.
+    """
+    try:
+        img = PILImage.open(BytesIO(data))
+        img.draft("L", (64, 64))
+        img.load()
+    except (UnidentifiedImageError, PILImage.DecompressionBombError, OSError, ValueError):
+        raise ImageRejected("The stored image could not be decoded.")
+    return difference_hash(img)
+
+
+def process_upload(data, max_pixels, sizes=(), formats=()):
+    """
+    Decodes an uploaded image and encodes the thumbnail and renditions to store.
+
+    Runs in a worker process, so it only takes and returns plain data. The
+    pixel count is read from the file header and checked before any pixel
+    data is decoded, and JPEGs are decoded at a reduced scale via draft().
+
+    Renditions keep the aspect ratio and fit within size x size pixels; an
+    image is never scaled up, so a small upload yields renditions at its own
+    size.
+
+    Args:
+        data (bytes): The uploaded file.
+        max_pixels (int): Largest accepted width * height.
+        sizes (tuple): Bounding box sizes of the renditions to produce.
+        formats (tuple): Rendition formats, keys of RENDITION_ENCODERS.
+
+    Returns:
+        ProcessedUpload: The encoded thumbnail and renditions, and the image's perceptual hash.
+
+    Raises:
+        ImageRejected: If the file is not a readable image or is too large.
+    """
+    try:
+        # Opening only parses the header; pixels are decoded on first use
+        img = PILImage.open(BytesIO(data))
+    except (UnidentifiedImageError, PILImage.DecompressionBombError, OSError):
+        raise ImageRejected("The uploaded file is not a supported image.")
+
+    original_format = img.format
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageRejected(f"Images may have at most {max_pixels:,} pixels.")
+
+    # JPEG only: let the decoder downscale by up to 8x, but not below the largest rendition
+    largest = max(sizes, default=THUMBNAIL_SIZE[0])
+    img.draft("RGB", (largest, largest))
+
+    try:
+        img.load()
+    except (OSError, ValueError):
+        raise ImageRejected("The uploaded image could not be decoded.")
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+
+    thumbnail = img.resize(THUMBNAIL_SIZE, PILImage.LANCZOS)
+
+    renditions = []
+    for size in sorted(sizes):
+        resized = ImageOps.contain(img, (size, size), PILImage.LANCZOS) if max(img.size) > size else img
+        for fmt in formats:
+            renditions.append((size, fmt, _encode(resized, fmt)))
+
+    return ProcessedUpload(_encode(thumbnail, "png"), original_format, renditions, difference_hash(img))
+
+
+def render_qr_png(unique_number):
+    """
+    Renders the QR code for an approved image's unique number.
+
+    Args:
+        unique_number (str): The image's unique number.
+
+    Returns:
+        bytes: The QR code encoded as PNG.
+    """
+    # Create a QR code instance with error correction and size settings
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=5,
+        border=2
+    )
+
+    # Add the image's unique number to the QR code
+    qr.add_data(f"Image ID: {unique_number}")
+    qr.make(fit=True)
+
+    # Generate the QR code image and encode it as PNG
+    img = qr.make_image(fill="black", back_color="white")
+    img_io = BytesIO()
+    img.save(img_io, "PNG")
+    return img_io.getvalue()
@@ -0,0 +1,271 @@
+import atexit
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+
+from models import db, OutboxEmail
+
+
+def configure_mail(app):
+    """
+    Sets the outgoing mail settings of an app, leaving values it already has.
+
+    Settings:
+        MAIL_SERVER, MAIL_PORT: SMTP server the outbox is sent through.
+        MAIL_USE_TLS: Upgrade the connection with STARTTLS before logging in.
+        MAIL_USERNAME, MAIL_PASSWORD: SMTP login; no login when unset, e.g.
+            for a local test server.
+        MAIL_SENDER: From address, defaults to MAIL_USERNAME.
+        MAIL_TIMEOUT: Seconds an SMTP command may take.
+        MAIL_SENDER_ENABLED: Send the outbox from a background thread in
+            each app process. When off, run `flask send-outbox` instead.
+        MAIL_POLL_SECONDS: How often the sender looks for due emails when it
+            has not been woken by a new one.
+        MAIL_BATCH_SIZE: Emails claimed and sent per batch.
+        MAIL_CLAIM_SECONDS: How long a claimed email is reserved for the
+            process that claimed it, after which another may retry it.
+        MAIL_MAX_ATTEMPTS: Sends tried before an email is marked failed.
+        MAIL_RETRY_BASE_SECONDS: Delay before the first retry; doubled after
+            each further failure.
+        MAIL_IDLE_SECONDS: Idle time after which the SMTP connection is closed.
+    """
+    app.config.setdefault("MAIL_SERVER", os.environ.get("MAIL_SERVER", "smtp.gmail.com"))
+    app.config.setdefault("MAIL_PORT", int(os.environ.get("MAIL_PORT", 587)))
+    app.config.setdefault("MAIL_USE_TLS", os.environ.get("MAIL_USE_TLS", "1") == "1")
+    app.config.setdefault("MAIL_USERNAME", os.environ.get("GMAIL_USER"))
+    app.config.setdefault("MAIL_PASSWORD", os.environ.get("GMAIL_APP_PASSWORD"))
+    app.config.setdefault("MAIL_SENDER", app.config["MAIL_USERNAME"])
+    app.config.setdefault("MAIL_TIMEOUT", 10)
+    app.config.setdefault("MAIL_SENDER_ENABLED", True)
+    app.config.setdefault("MAIL_POLL_SECONDS", 5)
+    app.config.setdefault("MAIL_BATCH_SIZE", 50)
+    app.config.setdefault("MAIL_CLAIM_SECONDS", 300)
+    app.config.setdefault("MAIL_MAX_ATTEMPTS", 8)
+    app.config.setdefault("MAIL_RETRY_BASE_SECONDS", 30)
+    app.config.setdefault("MAIL_IDLE_SECONDS", 60)
+
+
+def enqueue_email(recipient_email, subject, body):
+    """
+    Adds an email to the outbox and commits, so it survives a restart.
+
+    The request returns straight away; the background sender is woken to
+    deliver it. Commits the session.
+    """
+    db.session.add(OutboxEmail(recipient=recipient_email, subject=subject, body=body))
+    db.session.commit()
+
+    sender = get_mail_sender()
+    if sender is not None:
+        sender.wake()
+
+
+class SMTPConnection:
+    """
+    A reusable, authenticated connection to the configured SMTP server.
+
+    The connection is opened on the first send and kept for the following
+    ones, so STARTTLS and login happen once per connection rather than once
+    per email. It is closed after MAIL_IDLE_SECONDS without sends and
+    reopened transparently if the server dropped it.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._smtp = None
+        self._last_used = 0
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.config["MAIL_SERVER"], self.config["MAIL_PORT"],
+                            timeout=self.config["MAIL_TIMEOUT"])
+        try:
+            if self.config["MAIL_USE_TLS"]:
+                smtp.starttls()
+            if self.config["MAIL_USERNAME"]:
+                smtp.login(self.config["MAIL_USERNAME"], self.config["MAIL_PASSWORD"])
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def send(self, recipient, message):
+        """Sends one message, reconnecting once if the kept connection was dropped."""
+        if self._smtp is not None and time.monotonic() - self._last_used > self.config["MAIL_IDLE_SECONDS"]:
+            self.close()
+        for retry in (False, True):
+            if self._smtp is None:
+                self._smtp = self._open()
+            try:
+                self._smtp.sendmail(self.config["MAIL_SENDER"], [recipient], message)
+                break
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if retry:
+                    raise
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            self._smtp.close()
+        except OSError:
+            pass
+        self._smtp = None
+
+
+def _build_message(sender, email):
+    message = MIMEText(email.body)
+    message["Subject"] = email.subject
+    message["From"] = sender
+    message["To"] = email.recipient
+    return message.as_string()
+
+
+# Emails that may be claimed at the given time: pending, due, and not reserved by another process
+def _claimable(now):
+    return (
+        OutboxEmail.status == "pending",
+        OutboxEmail.next_attempt_at <= now,
+        or_(OutboxEmail.claimed_until.is_(None), OutboxEmail.claimed_until < now),
+    )
+
+
+def claim_emails(batch_size, claim_seconds):
+    """
+    Reserves up to batch_size due emails for this process and commits.
+
+    One UPDATE ... RETURNING marks the rows as claimed and counts the
+    attempt. The claim conditions are repeated on the updated rows, so two
+    processes racing for the same email cannot both claim it. An email whose
+    sender died is claimable again once its claim expires.
+
+    Returns:
+        list: The claimed rows (id, recipient, subject, body, attempts).
+    """
+    now = datetime.utcnow()
+    due = (
+        select(OutboxEmail.id).where(*_claimable(now))
+        .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+        .limit(batch_size)
+    )
+    rows = db.session.execute(
+        update(OutboxEmail)
+        .where(OutboxEmail.id.in_(due), *_claimable(now))
+        .values(claimed_until=now + timedelta(seconds=claim_seconds), attempts=OutboxEmail.attempts + 1)
+        .returning(OutboxEmail.id, OutboxEmail.recipient, OutboxEmail.subject,
+                   OutboxEmail.body, OutboxEmail.attempts),
+        execution_options={"synchronize_session": False},
+    ).all()
+    db.session.commit()
+    return rows
+
+
+def send_due_emails(connection, config):
+    """
+    Claims and sends one batch of due emails over the given connection.
+
+    Sent emails are marked as such, and failed ones are scheduled for a
+    retry after an exponentially growing delay, or marked failed after
+    MAIL_MAX_ATTEMPTS. Any error fails only the email being sent, so the
+    emails already delivered are still marked sent rather than sent again
+    once their claim expires. The outcomes are written with one batched
+    UPDATE.
+
+    Returns:
+        int: The number of emails claimed, 0 when none were due.
+    """
+    emails = claim_emails(config["MAIL_BATCH_SIZE"], config["MAIL_CLAIM_SECONDS"])
+    results = []
+    for email in emails:
+        try:
+            connection.send(email.recipient, _build_message(config["MAIL_SENDER"], email))
+            results.append({"id": email.id, "status": "sent", "sent_at": datetime.utcnow(),
+                            "claimed_until": None, "last_error": None})
+        except Exception as e:
+            connection.close()
+            delay = config["MAIL_RETRY_BASE_SECONDS"] * 2 ** (email.attempts - 1)
+            give_up = email.attempts >= config["MAIL_MAX_ATTEMPTS"]
+            results.append({"id": email.id, "status": "failed" if give_up else "pending",
+                            "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+                            "claimed_until": None, "last_error": str(e)[:255]})
+            print(f"Email {email.id} to {email.recipient} failed: {e}")
+
+    if results:
+        db.session.execute(update(OutboxEmail), results)
+    db.session.commit()
+    return len(emails)
+
+
+class MailSender:
+    """
+    Background thread that delivers the outbox.
+
+    It sends every due email in batches whenever it is woken by a new email
+    and at least every MAIL_POLL_SECONDS, so retries go out when they fall
+    due. Emails are claimed in the database before they are sent, so each
+    app process may run its own sender.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.connection = SMTPConnection(app.config)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mail-sender", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def wake(self):
+        """Makes the sender look for due emails now."""
+        self._wake.set()
+
+    def send_all(self):
+        """Sends batches until no email is due."""
+        with self.app.app_context():
+            try:
+                while send_due_emails(self.connection, self.app.config):
+                    pass
+            except Exception as e:
+                db.session.rollback()
+                print(f"Sending the outbox failed: {e}")
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.app.config["MAIL_POLL_SECONDS"])
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.send_all()
+        self.connection.close()
+
+    def close(self):
+        """Stops the sender thread; unsent emails stay in the outbox."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+
+_sender_lock = threading.Lock()
+
+
+def get_mail_sender():
+    """Returns the app's mail sender, starting it on first use, or None if it is disabled."""
+    app = current_app._get_current_object()
+    if not app.config["MAIL_SENDER_ENABLED"]:
+        return None
+    with _sender_lock:
+        sender = app.extensions.get("mail_sender")
+        if sender is None:
+            sender = MailSender(app)
+            app.extensions["mail_sender"] = sender
+    return sender
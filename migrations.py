@@ -0,0 +1,191 @@
+from sqlalchemy import bindparam, inspect, select, update
+from sqlalchemy.schema import CreateColumn
+
+from follows import recount_follow_counts
+from models import db, ArtistStats, Image
+from ranking import hot_score
+from search import create_search_index
+from stats import rebuild_artist_stats
+
+
+# Adds any model columns that are missing from existing tables
+def add_missing_columns():
+    """
+    Brings tables created by older versions of the app up to date.
+
+    db.create_all() only creates tables that do not exist yet, so columns
+    added to a model later are appended here with ALTER TABLE. New columns
+    must be nullable or declare a server_default.
+    """
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}')
+                print(f"Added column {table.name}.{column.name}")
+
+
+# Allows image rows without inline image data once blobs live in the blob store
+def relax_image_data():
+    columns = {column["name"]: column for column in inspect(db.engine).get_columns("image")}
+    if columns["image_data"]["nullable"]:
+        return
+
+    if db.engine.dialect.name != "sqlite":
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE image ALTER COLUMN image_data DROP NOT NULL")
+        return
+
+    # SQLite cannot drop NOT NULL in place, so the table is rebuilt with the
+    # same definition minus the constraint, in a single transaction
+    with db.engine.connect() as conn:
+        create_sql = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'image'"
+        ).scalar()
+
+    rebuilt_sql = create_sql.replace("CREATE TABLE image", "CREATE TABLE image_rebuild", 1)
+    rebuilt_sql = rebuilt_sql.replace("image_data BLOB NOT NULL", "image_data BLOB", 1)
+    if "image_data BLOB NOT NULL" in rebuilt_sql or "image_rebuild" not in rebuilt_sql:
+        raise RuntimeError("Unrecognised definition of table image, upgrade it manually")
+
+    raw = db.engine.raw_connection()
+    try:
+        raw.driver_connection.executescript(f"""
+            PRAGMA foreign_keys = OFF;
+            BEGIN;
+            {rebuilt_sql};
+            INSERT INTO image_rebuild SELECT * FROM image;
+            DROP TABLE image;
+            ALTER TABLE image_rebuild RENAME TO image;
+            COMMIT;
+        """)
+    finally:
+        raw.close()
+    print("Rebuilt table image to allow blob-store images")
+
+
+# Removes duplicate votes left by concurrent clicks, so the unique vote index can be created
+def dedupe_votes():
+    if "uq_vote_user_image" in {index["name"] for index in inspect(db.engine).get_indexes("vote")}:
+        return
+
+    with db.engine.begin() as conn:
+        removed = conn.exec_driver_sql("""
+            DELETE FROM vote WHERE id NOT IN (
+                SELECT MAX(id) FROM vote GROUP BY user_id, image_id
+            )
+        """).rowcount
+        if removed:
+            # Recount every image from the remaining votes
+            conn.exec_driver_sql("""
+                UPDATE image SET vote_count = (
+                    SELECT COALESCE(SUM(CASE vote_type WHEN 'upvote' THEN 1 WHEN 'downvote' THEN -1 ELSE 0 END), 0)
+                    FROM vote WHERE vote.image_id = image.id
+                )
+            """)
+            print(f"Removed {removed} duplicate votes")
+
+
+# Removes duplicate follows so the unique follower index can be created, then fills in the follow counters
+def dedupe_followers():
+    if "uq_follower_follower_followed" in {index["name"] for index in inspect(db.engine).get_indexes("follower")}:
+        return
+
+    with db.engine.begin() as conn:
+        removed = conn.exec_driver_sql("""
+            DELETE FROM follower WHERE id NOT IN (
+                SELECT MIN(id) FROM follower GROUP BY follower_id, followed_id
+            )
+        """).rowcount
+        conn.execute(recount_follow_counts())
+        if removed:
+            print(f"Removed {removed} duplicate follows")
+
+
+# Creates indexes declared on the models that existing tables do not have yet
+def create_missing_indexes():
+    created = 0
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+                    created += 1
+    if created:
+        print(f"Created {created} indexes")
+
+
+# Fills the artist stats table the first time it is created on a database that already has approved images
+def backfill_artist_stats():
+    with db.engine.begin() as conn:
+        if conn.execute(select(ArtistStats.user_id).limit(1)).first() is not None:
+            return
+        if conn.execute(select(Image.id).where(Image.moderation_status == "approved").limit(1)).first() is None:
+            return
+        rebuild_artist_stats(conn)
+    print("Filled in artist stats")
+
+
+# Computes the hot score of images uploaded before it existed, in batches
+def backfill_hot_scores(batch_size=500):
+    filled = 0
+    while True:
+        with db.engine.begin() as conn:
+            conn.execute(update(Image).where(Image.vote_count.is_(None)).values(vote_count=0))
+            rows = conn.execute(
+                select(Image.id, Image.vote_count, Image.upload_date)
+                .where(Image.hot_score.is_(None))
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                update(Image).where(Image.id == bindparam("image_id")).values(hot_score=bindparam("score")),
+                [{"image_id": row.id, "score": hot_score(row.vote_count, row.upload_date)} for row in rows],
+            )
+            filled += len(rows)
+    if filled:
+        print(f"Computed hot scores of {filled} images")
+
+
+# Creates the full-text search index over images, artists and comments (SQLite only)
+def create_full_text_search():
+    if db.engine.dialect.name != "sqlite":
+        return
+    with db.engine.begin() as conn:
+        if "image_search" in inspect(conn).get_table_names():
+            return
+        create_search_index(conn)
+    print("Created the full-text search index")
+
+
+# Schema upgrade steps, run in order; every step must be safe to run repeatedly
+UPGRADE_STEPS = [
+    add_missing_columns,
+    relax_image_data,
+    dedupe_votes,
+    dedupe_followers,
+    create_missing_indexes,
+    backfill_artist_stats,
+    backfill_hot_scores,
+    create_full_text_search,
+]
+
+
+def upgrade_database():
+    """
+    Creates missing tables and applies every schema upgrade step.
+    Must be called inside an application context.
+    """
+    db.create_all()
+    for step in UPGRADE_STEPS:
+        step()
@@ -1,5 +1,3 @@
-import random
-import string
 from datetime import datetime
 from sqlalchemy import LargeBinary
 from flask_sqlalchemy import SQLAlchemy
@@ -7,9 +5,10 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer
 from flask import current_app
+from database import RoutingSession
 
-# Initialize database instance
-db = SQLAlchemy()
+# Initialize database instance; reads may be routed to a separate reader engine
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 # User Model: Represents registered users
 class User(db.Model, UserMixin):
@@ -19,14 +18,8 @@ class User(db.Model, UserMixin):
     password_hash = db.Column(db.String(255), nullable=False)
     is_superuser = db.Column(db.Boolean, default=False)  # Identifies admin users
     is_verified = db.Column(db.Boolean, default=False)  # Email verification status
-
-    # Returns the number of followers the user has
-    def follower_count(self):
-        return Follower.query.filter_by(followed_id=self.id).count()
-
-    # Returns the number of users the current user follows
-    def following_count(self):
-        return Follower.query.filter_by(follower_id=self.id).count()
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # Users following this user
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # Users this user follows
 
     # Hash and set the user's password
     def set_password(self, password):
@@ -54,16 +47,46 @@ class User(db.Model, UserMixin):
 
 # Image Model: Represents uploaded images
 class Image(db.Model):
+    # Listings filter on status, category or archive state and page by (upload_date, id);
+    # profiles look up a user's approved images by votes
+    __table_args__ = (
+        db.Index('ix_image_upload', 'upload_date', 'id'),
+        db.Index('ix_image_status_upload', 'moderation_status', 'upload_date', 'id'),
+        db.Index('ix_image_status_category_upload', 'moderation_status', 'category', 'upload_date', 'id'),
+        db.Index('ix_image_category_upload', 'category', 'upload_date', 'id'),
+        db.Index('ix_image_archived_upload', 'is_archived', 'upload_date', 'id'),
+        db.Index('ix_image_archived_category_upload', 'is_archived', 'category', 'upload_date', 'id'),
+        db.Index('ix_image_user_status_votes', 'user_id', 'moderation_status', 'vote_count'),
+        db.Index('ix_image_user', 'user_id', 'id'),  # An artist's images in upload order, e.g. for ZIP downloads
+        # Hot and top rankings of approved images, overall and per category
+        db.Index('ix_image_status_hot', 'moderation_status', 'hot_score', 'id'),
+        db.Index('ix_image_status_category_hot', 'moderation_status', 'category', 'hot_score', 'id'),
+        db.Index('ix_image_status_votes', 'moderation_status', 'vote_count', 'id'),
+        db.Index('ix_image_status_category_votes', 'moderation_status', 'category', 'vote_count', 'id'),
+        # Possible duplicates awaiting review, newest first; partial, so it only holds flagged images
+        db.Index('ix_image_duplicate_upload', 'upload_date', 'id',
+                 sqlite_where=db.text('duplicate_of_id IS NOT NULL'),
+                 postgresql_where=db.text('duplicate_of_id IS NOT NULL')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)  # Image title
-    image_data = db.Column(db.LargeBinary, nullable=False)  # Stores image as binary data
+    image_data = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Legacy inline image data, see migrate-blobs
+    content_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the image in the blob store
+    content_size = db.Column(db.Integer, nullable=True)  # Size of the stored image in bytes
+    original_hash = db.Column(db.String(64), nullable=True)  # Blob store hash of the file as uploaded
+    original_format = db.Column(db.String(10), nullable=True)  # Format of the uploaded file, e.g. JPEG
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)  # Timestamp of upload
     moderation_status = db.Column(db.String(20), default="unmoderated")  # Status: unmoderated, pending, approved
     category = db.Column(db.String(20), default="Nature")  # Image category: Nature, Art, Technology, Memes, Photography
     is_archived = db.Column(db.Boolean, default=False)  # Superuser archive status
     artist_archived = db.Column(db.Boolean, default=False)  # User archive status
     unique_number = db.Column(db.String(10), unique=True, nullable=True)  # Unique identifier for moderated image
+    qr_hash = db.Column(db.String(64), nullable=True)  # Blob store hash of the cached QR code, cleared when unapproved
     vote_count = db.Column(db.Integer, default=0)  # Stores total votes
+    hot_score = db.Column(db.Float, nullable=True)  # Time-weighted ranking score, see ranking.py
+    phash = db.Column(db.String(16), nullable=True)  # Perceptual (difference) hash, see duplicates.py
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=True)  # Earlier image this one resembles
 
     last_reset_date = db.Column(db.DateTime, nullable=True)  # Timestamp of last vote reset
     last_reset_reason = db.Column(db.String(255), nullable=True)  # Reason for vote reset
@@ -72,18 +95,48 @@ class Image(db.Model):
     user = db.relationship('User', backref=db.backref('images', lazy=True))  # Relationship with the User model
 
     votes = db.relationship('Vote', back_populates="image")  # One-to-many relationship with votes
+    duplicate_of = db.relationship('Image', remote_side=[id])  # The earlier image this one resembles
+
+
+# UniqueNumberCounter Model: Sequence that unique numbers are drawn from, see unique_numbers.py
+class UniqueNumberCounter(db.Model):
+    name = db.Column(db.String(20), primary_key=True)  # What the sequence numbers, e.g. 'image'
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)  # First sequence value not yet issued
+
 
-    # Generate a unique 10-digit number for the image
-    def generate_unique_number(self):
-        return ''.join(random.choices(string.digits, k=10))
+# ImageHashBand Model: One 16-bit band of an image's perceptual hash, for near-duplicate lookups
+class ImageHashBand(db.Model):
+    band = db.Column(db.SmallInteger, primary_key=True)  # Which quarter of the hash, 0 to 3
+    value = db.Column(db.Integer, primary_key=True)  # The band's bits
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), primary_key=True)  # Image the hash belongs to
+
+
+# ImageRendition Model: A resized copy of an image in one format, stored in the blob store
+class ImageRendition(db.Model):
+    __table_args__ = (db.UniqueConstraint('image_id', 'size', 'format'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False)  # Image this rendition belongs to
+    size = db.Column(db.Integer, nullable=False)  # Bounding box the rendition fits in, in pixels
+    format = db.Column(db.String(10), nullable=False)  # Encoding: 'webp', 'png' or 'avif'
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the rendition in the blob store
+    content_size = db.Column(db.Integer, nullable=False)  # Size of the rendition in bytes
+
+    image = db.relationship('Image', backref=db.backref('renditions', lazy=True))  # Relationship with Image model
 
 
 # Vote Model: Tracks user votes on images
 class Vote(db.Model):
+    __table_args__ = (
+        db.Index('uq_vote_user_image', 'user_id', 'image_id', unique=True),  # One vote per user per image
+        db.Index('ix_vote_image', 'image_id'),  # Votes of an image, e.g. when they are reset
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Voter's user ID
     image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False)  # Image being voted on
     vote_type = db.Column(db.String(10), nullable=False)  # Vote type: 'upvote' or 'downvote'
+    created_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)  # When the vote was cast or last changed
 
     user = db.relationship('User', backref=db.backref('votes', lazy=True))  # Relationship with User model
     image = db.relationship('Image', back_populates="votes")  # Relationship with Image model
@@ -91,6 +144,11 @@ class Vote(db.Model):
 
 # Follower Model: Tracks user-to-user follow relationships
 class Follower(db.Model):
+    __table_args__ = (
+        db.Index('uq_follower_follower_followed', 'follower_id', 'followed_id', unique=True),  # Who a user follows, once each
+        db.Index('ix_follower_followed', 'followed_id', 'id'),  # A user's followers, newest first
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # User following another user
     followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # User being followed
@@ -99,8 +157,45 @@ class Follower(db.Model):
     followed = db.relationship('User', foreign_keys=[followed_id], backref=db.backref('followers_list', lazy=True))
 
 
+# ArtistStats Model: Per-artist totals over approved images, kept up to date by stats.py
+class ArtistStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)  # The artist
+    top_image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=True)  # Most upvoted approved image
+    top_image_votes = db.Column(db.Integer, nullable=False, default=0)  # Vote count of the top image
+    approved_count = db.Column(db.Integer, nullable=False, default=0)  # Number of approved images
+    total_votes = db.Column(db.Integer, nullable=False, default=0)  # Sum of votes over approved images
+
+    user = db.relationship('User', backref=db.backref('stats', uselist=False, lazy=True))  # Relationship with User model
+    top_image = db.relationship('Image')  # Relationship with Image model
+
+
+# CacheGeneration Model: Counters bumped to invalidate in-process caches in every worker process
+class CacheGeneration(db.Model):
+    name = db.Column(db.String(20), primary_key=True)  # Which cache, e.g. 'users'
+    value = db.Column(db.Integer, nullable=False, default=0)  # Bumped whenever cached data changes
+
+
+# OutboxEmail Model: An email waiting to be sent, or the record of one, see mailer.py
+class OutboxEmail(db.Model):
+    __table_args__ = (db.Index('ix_outbox_email_status_due', 'status', 'next_attempt_at', 'id'),)  # Due emails, oldest first
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(100), nullable=False)  # Address the email goes to
+    subject = db.Column(db.String(255), nullable=False)  # Subject line
+    body = db.Column(db.Text, nullable=False)  # Plain-text body
+    status = db.Column(db.String(10), nullable=False, default="pending")  # Status: pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Sends tried so far
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # When the email was queued
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Earliest time of the next try
+    claimed_until = db.Column(db.DateTime, nullable=True)  # Reserved by a sender until then
+    sent_at = db.Column(db.DateTime, nullable=True)  # When the email was delivered to the SMTP server
+    last_error = db.Column(db.String(255), nullable=True)  # Why the last try failed
+
+
 # Comment Model: Stores user comments on images
 class Comment(db.Model):
+    __table_args__ = (db.Index('ix_comment_image_timestamp', 'image_id', 'timestamp', 'id'),)  # Comments of an image, newest first
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)  # Comment text
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # Timestamp of comment
@@ -0,0 +1,103 @@
+from sqlalchemy import select, update
+
+from models import db, Image
+from stats import rebuild_artist_stats
+from unique_numbers import allocate_unique_numbers
+
+
+# Moderation statuses and categories a superuser can set
+MODERATION_STATUSES = ["approved", "pending", "unmoderated"]
+CATEGORIES = ["Nature", "Art", "Technology", "Memes", "Photography"]
+
+
+class BulkModerationError(ValueError):
+    """Raised when a bulk moderation request is invalid; nothing has been changed."""
+
+
+def assign_unique_numbers(image_ids):
+    """
+    Gives each of the images a new unique number, allocated together and
+    written with one batched UPDATE. Does not commit.
+    """
+    numbers = allocate_unique_numbers(len(image_ids))
+    db.session.execute(
+        update(Image),
+        [{"id": image_id, "unique_number": number} for image_id, number in zip(image_ids, numbers)],
+    )
+
+
+def bulk_moderate(image_ids, status=None, category=None, archived=None, max_images=None):
+    """
+    Applies one moderation change to many images in a single transaction.
+
+    The ids are validated with one query, and the status, category and
+    archive flag are set with one set-based UPDATE. Images approved for the
+    first time get unique numbers in bulk; their QR codes are rendered on
+    first request. Leaving approval clears the stored QR code, and
+    unmoderated images are unarchived, as with single-image moderation.
+    The stats of every affected artist are recomputed at the end. Does not
+    commit.
+
+    Args:
+        image_ids (list): Ids of the images to change.
+        status (str): New moderation status, or None to keep it.
+        category (str): New category, or None to keep it.
+        archived (bool): New archive flag, or None to keep it.
+        max_images (int): Largest number of images accepted in one request.
+
+    Returns:
+        int: The number of images changed.
+
+    Raises:
+        BulkModerationError: If the request is invalid or an image does not exist.
+    """
+    image_ids = sorted(set(image_ids))
+    if not image_ids:
+        raise BulkModerationError("No images were selected.")
+    if max_images is not None and len(image_ids) > max_images:
+        raise BulkModerationError(f"At most {max_images} images can be changed at once.")
+    if status is not None and status not in MODERATION_STATUSES:
+        raise BulkModerationError("Invalid status update!")
+    if category is not None and category not in CATEGORIES:
+        raise BulkModerationError("Invalid category!")
+    if status is None and category is None and archived is None:
+        raise BulkModerationError("Choose a status, category or archive change.")
+
+    # Validate every id with one query, reading what the side effects need
+    rows = db.session.execute(
+        select(Image.id, Image.user_id, Image.moderation_status, Image.unique_number)
+        .where(Image.id.in_(image_ids))
+    ).all()
+    missing = set(image_ids) - {row.id for row in rows}
+    if missing:
+        raise BulkModerationError(f"Images not found: {', '.join(map(str, sorted(missing)))}")
+
+    values = {}
+    if status is not None:
+        values["moderation_status"] = status
+        if status != "approved":
+            values["qr_hash"] = None
+    if category is not None:
+        values["category"] = category
+    if archived is not None:
+        values["is_archived"] = archived
+    if status == "unmoderated":
+        values["is_archived"] = False
+
+    db.session.execute(
+        update(Image).where(Image.id.in_(image_ids)).values(**values),
+        execution_options={"synchronize_session": False},
+    )
+
+    if status == "approved":
+        unnumbered = [row.id for row in rows if not row.unique_number]
+        if unnumbered:
+            assign_unique_numbers(unnumbered)
+
+    # Approval changes move images in or out of their artists' stats
+    if status is not None:
+        changed_artists = {row.user_id for row in rows if (row.moderation_status == "approved") != (status == "approved")}
+        if changed_artists:
+            rebuild_artist_stats(db.session, sorted(changed_artists))
+
+    return len(rows)
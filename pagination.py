@@ -0,0 +1,149 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+from heapq import merge
+from itertools import islice
+
+from sqlalchemy import tuple_
+
+
+# A single page of keyset-paginated results
+KeysetPage = namedtuple("KeysetPage", ["items", "next_cursor"])
+
+
+def encode_cursor(values):
+    """
+    Encodes the sort key of the last row on a page into an opaque cursor.
+
+    Args:
+        values (list): The values of the ordering columns for the last row.
+
+    Returns:
+        str: A URL-safe cursor string.
+    """
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decodes a cursor produced by encode_cursor back into column values.
+
+    Args:
+        cursor (str): The cursor taken from the request.
+        columns (list): The ordering columns the cursor was built from.
+
+    Returns:
+        list: The decoded values, or None if the cursor is missing, malformed,
+            or holds a value that does not match its column's type.
+    """
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(payload, list) or len(payload) != len(columns):
+        return None
+
+    values = []
+    for column, value in zip(columns, payload):
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return None
+        if python_type is datetime:
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                return None
+        elif python_type is float and type(value) is int:
+            value = float(value)
+        elif python_type not in (int, float, str) or type(value) is not python_type:
+            # Anything else, e.g. a list or object from a crafted cursor, would be bound straight into SQL
+            return None
+        values.append(value)
+    return values
+
+
+def keyset_page(query, columns, cursor=None, per_page=50, key=None):
+    """
+    Returns one page of a query ordered newest-first by the given columns.
+
+    The last column must be unique (normally the primary key) so that rows
+    with equal leading values still have a stable position. Instead of an
+    OFFSET, the page starts strictly after the row encoded in the cursor, so
+    every page costs the same however deep the reader has scrolled.
+
+    Args:
+        query (Query): The filtered query to paginate.
+        columns (list): Ordering columns, most significant first.
+        cursor (str): Cursor returned with the previous page, if any.
+        per_page (int): Maximum number of rows on the page.
+        key (callable): Extracts the ordering values from a row. Defaults to
+            reading each column's attribute name from the row.
+
+    Returns:
+        KeysetPage: The rows on this page and the cursor for the next one.
+    """
+    values = decode_cursor(cursor, columns)
+    if values is not None:
+        query = query.filter(tuple_(*columns) < tuple_(*values))
+
+    rows = query.order_by(*[column.desc() for column in columns]).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        if key is None:
+            next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+        else:
+            next_cursor = encode_cursor(key(last))
+
+    return KeysetPage(rows, next_cursor)
+
+
+def merged_keyset_page(queries, columns, cursor=None, per_page=50):
+    """
+    Returns one page of the rows of several queries, as if they were one
+    query ordered newest-first by the given columns.
+
+    Use it instead of an IN filter on a leading index column, which stops
+    the index from returning rows in order and makes every page sort all
+    matching rows. Each query reads at most one page from its own index
+    range and the pages are merged, so a page still costs the same however
+    deep the reader has scrolled. The queries must not share rows.
+
+    Args:
+        queries (list): Filtered queries whose rows make up the listing.
+        columns (list): Ordering columns, most significant first; the last must be unique.
+        cursor (str): Cursor returned with the previous page, if any.
+        per_page (int): Maximum number of rows on the page.
+
+    Returns:
+        KeysetPage: The rows on this page and the cursor for the next one.
+    """
+    values = decode_cursor(cursor, columns)
+    order = [column.desc() for column in columns]
+    key = lambda row: [getattr(row, column.key) for column in columns]
+
+    pages = []
+    for query in queries:
+        if values is not None:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        pages.append(query.order_by(*order).limit(per_page + 1).all())
+
+    rows = list(islice(merge(*pages, key=key, reverse=True), per_page + 1))
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(key(rows[-1]))
+
+    return KeysetPage(rows, next_cursor)
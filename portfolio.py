@@ -0,0 +1,127 @@
+import csv
+import io
+import zipfile
+
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from models import db, Image
+
+
+# Bytes copied from a blob into the ZIP at a time
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Columns of the manifest listing every image in the ZIP
+MANIFEST_FIELDS = ["file", "name", "category", "moderation_status", "unique_number", "vote_count", "upload_date"]
+
+
+class _ZipSink(io.RawIOBase):
+    """
+    Write-only stream the ZIP is written into. It cannot seek, so zipfile
+    writes sizes and checksums after each entry's data, and whatever it has
+    written so far can be sent to the client at any point.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        """Returns and forgets everything written since the last drain."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Reads one batch of an artist's images after last_id, in id order
+def _image_batch(user_id, last_id, batch_size, *columns):
+    return db.session.execute(
+        select(Image.id, *columns)
+        .where(Image.user_id == user_id, Image.id > last_id)
+        .order_by(Image.id)
+        .limit(batch_size)
+    ).all()
+
+
+# Name of an image inside the ZIP: id first, so names are unique, then the title and the stored format
+def _entry_name(image):
+    if image.original_hash:
+        extension = (image.original_format or "img").lower().replace("jpeg", "jpg")
+    else:
+        extension = "png"
+    return f"images/{image.id}-{secure_filename(image.name) or 'image'}.{extension}"
+
+
+def stream_portfolio(user_id, store, batch_size=50):
+    """
+    Yields a ZIP of every image an artist uploaded, piece by piece.
+
+    Images are read in batches of batch_size rows and each file is copied
+    from the blob store in 64 KiB chunks, yielding the compressed output as
+    it is produced, so memory stays flat however large the portfolio is.
+    Each image is included as uploaded when the original was kept, else as
+    stored. A manifest.csv with every image's name, category, status,
+    unique number and votes is written last, again in batches.
+
+    Must run inside an application context, e.g. with stream_with_context.
+
+    Args:
+        user_id (int): The artist whose images are zipped.
+        store (BlobStore): Where the images are read from.
+        batch_size (int): Images read per query.
+
+    Yields:
+        bytes: Consecutive pieces of the ZIP file.
+    """
+    sink = _ZipSink()
+    # Every entry is deflated, at the fastest level since images are compressed already: streaming
+    # unzippers reject stored entries whose sizes only follow the data, as they must here
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1, allowZip64=True) as zf:
+        last_id = 0
+        while True:
+            images = _image_batch(user_id, last_id, batch_size, Image.name, Image.original_hash,
+                                  Image.original_format, Image.content_hash)
+            if not images:
+                break
+            for image in images:
+                digest = image.original_hash or image.content_hash
+                with zf.open(_entry_name(image), mode="w") as entry:
+                    if digest:
+                        with store.open(digest) as blob:
+                            while chunk := blob.read(COPY_CHUNK_SIZE):
+                                entry.write(chunk)
+                                yield sink.drain()
+                    else:
+                        # Images not yet moved by migrate-blobs still keep their data inline
+                        entry.write(db.session.execute(
+                            select(Image.image_data).where(Image.id == image.id)
+                        ).scalar() or b"")
+                yield sink.drain()
+            last_id = images[-1].id
+
+        with zf.open("manifest.csv", mode="w") as entry:
+            text = io.TextIOWrapper(entry, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(MANIFEST_FIELDS)
+            last_id = 0
+            while True:
+                images = _image_batch(user_id, last_id, batch_size, Image.name, Image.original_hash,
+                                      Image.original_format, Image.category, Image.moderation_status,
+                                      Image.unique_number, Image.vote_count, Image.upload_date)
+                if not images:
+                    break
+                for image in images:
+                    writer.writerow([_entry_name(image), image.name, image.category, image.moderation_status,
+                                     image.unique_number or "", image.vote_count or 0,
+                                     image.upload_date.isoformat() if image.upload_date else ""])
+                text.flush()
+                yield sink.drain()
+                last_id = images[-1].id
+            text.detach()
+    yield sink.drain()
@@ -0,0 +1,46 @@
+import math
+from datetime import datetime
+
+from sqlalchemy import update
+
+from models import db, Image
+
+
+# Reference time of the hot score; only differences between scores matter
+HOT_EPOCH = datetime(2005, 12, 8, 7, 46, 43)
+
+# Age, in seconds, that weighs as much as a tenfold difference in votes
+HOT_DECAY_SECONDS = 45000
+
+
+def hot_score(vote_count, upload_date):
+    """
+    Computes an image's hot score, in the style of Reddit's ranking.
+
+    The vote term grows with the logarithm of the net votes, so the first
+    votes count the most, and the time term grows linearly with the upload
+    date. A newer image therefore outranks an older one unless the older one
+    has many times more votes. Because the score depends only on the vote
+    count and the upload date, it changes only when a vote arrives and can
+    be stored and indexed instead of being recomputed as time passes.
+
+    Args:
+        vote_count (int): The image's net votes.
+        upload_date (datetime): When the image was uploaded.
+
+    Returns:
+        float: The hot score; higher ranks first.
+    """
+    vote_count = vote_count or 0
+    order = math.log10(max(abs(vote_count), 1))
+    sign = (vote_count > 0) - (vote_count < 0)
+    seconds = ((upload_date or HOT_EPOCH) - HOT_EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_DECAY_SECONDS, 7)
+
+
+def set_hot_score(image_id, vote_count, upload_date):
+    """Stores the hot score of an image after its vote count changed. Does not commit."""
+    db.session.execute(
+        update(Image).where(Image.id == image_id).values(hot_score=hot_score(vote_count, upload_date)),
+        execution_options={"synchronize_session": False},
+    )
@@ -1,19 +1,37 @@
-import io
-from io import BytesIO
-import qrcode
+from concurrent.futures import TimeoutError as WorkerTimeout
 from datetime import datetime
-from PIL import Image as PILImage
 from flask import (
     Flask, render_template, redirect, url_for, flash, request,
-    Response, send_file, jsonify
+    Response, jsonify, abort, stream_with_context
 )
 from flask_login import (
     LoginManager, login_user, logout_user,
     login_required, current_user
 )
+from markupsafe import Markup
+from sqlalchemy.orm import defer, joinedload
 from werkzeug.utils import secure_filename
 
-from models import db, User, Image, Vote, Follower, Comment
+from models import db, User, Image, ImageRendition, Vote, Follower, Comment, ArtistStats
+from database import init_database
+from pagination import keyset_page, merged_keyset_page
+from storage import init_blob_store, get_blob_store, send_blob
+from http_cache import is_not_modified, set_cache_headers, not_modified_response
+from imaging import render_qr_png, process_upload, ImageRejected, RENDITION_MIMETYPES
+from workers import get_worker_pool, PoolSaturated, WorkerCrashed
+from votes import VOTE_VALUES, toggle_vote, get_vote_buffer
+from follows import follow, unfollow
+from ranking import hot_score
+from search import search_images
+from duplicates import find_duplicate, hamming_distance, index_image_hash
+from portfolio import stream_portfolio
+from moderation import bulk_moderate, BulkModerationError
+from cache import init_fragment_cache, get_fragment_cache, invalidate_listings, listing_tag
+from user_cache import init_user_cache, load_cached_user, invalidate_user_cache
+from stats import record_approval, record_unapproval, record_vote_change
+from unique_numbers import allocate_unique_number
+from mailer import configure_mail, enqueue_email, get_mail_sender
+from commands import register_commands
 from forms import (
     RegistrationForm, LoginForm, RequestResetForm,
     ResetPasswordForm, ChangeEmailForm, ChangePasswordForm
@@ -23,9 +41,32 @@ from forms import (
 app = Flask(__name__)
 
 app.config["SECRET_KEY"] = "thisdoesntmeananything"
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///database.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db.init_app(app)
+app.config["IMAGES_PER_PAGE"] = 50  # Page size for image listings
+app.config["FOLLOWERS_PER_PAGE"] = 50  # Page size for follower lists on profiles
+app.config["COMMENTS_PER_PAGE"] = 50  # Page size for comments on an image
+app.config["IMAGE_CACHE_MAX_AGE"] = 31536000  # Seconds browsers may reuse an image without revalidating
+app.config["QR_CACHE_MAX_AGE"] = 86400  # Seconds browsers may reuse a QR code without revalidating
+app.config["MAX_CONTENT_LENGTH"] = 20 * 1024 * 1024  # Largest accepted request body (uploads)
+app.config["IMAGE_MAX_PIXELS"] = 40_000_000  # Largest accepted upload, checked before decoding
+app.config["IMAGE_WORKERS"] = 2  # Processes decoding uploads; 0 processes them in the request thread
+app.config["IMAGE_QUEUE_SIZE"] = 8  # Uploads that may wait for a worker before returning 503
+app.config["IMAGE_PROCESSING_TIMEOUT"] = 30  # Seconds an upload may wait for its result
+app.config["UPLOAD_RETRY_AFTER"] = 5  # Retry-After seconds sent when the workers are saturated
+app.config["RENDITION_SIZES"] = (64, 200, 400, 800)  # Bounding boxes of the renditions made at upload
+app.config["RENDITION_FORMATS"] = ("webp", "png")  # Add "avif" if Pillow was built with AVIF support
+app.config["VOTE_BUFFER_ENABLED"] = False  # Buffer votes in memory and write them in batches
+app.config["VOTE_BUFFER_FLUSH_MS"] = 500  # How often buffered votes are written
+app.config["VOTE_BUFFER_MAX_STALENESS_MS"] = 2000  # Oldest a buffered vote may get before a click forces a write
+app.config["DUPLICATE_ACTION"] = "flag"  # "flag" stores near-duplicate uploads for review, "reject" refuses them
+app.config["DUPLICATE_MAX_DISTANCE"] = 3  # Differing hash bits still counted as a duplicate (at most 3)
+app.config["BULK_MODERATION_MAX_IMAGES"] = 5000  # Most images one bulk moderation request may change
+init_database(app, db)
+init_blob_store(app)
+init_fragment_cache(app)
+init_user_cache(app)
+configure_mail(app)
+register_commands(app)
 
 
 login_manager = LoginManager()
@@ -33,10 +74,13 @@ login_manager.init_app(app)
 login_manager.login_view = "login"
 
 
-from app import send_email
+# Start the mail sender with the first request, so emails left in the outbox by a restart still go out
+@app.before_request
+def start_mail_sender():
+    get_mail_sender()
 
 
-# Load user from the database using Flask-Login
+# Load user for Flask-Login, from the user cache when it is current
 @login_manager.user_loader
 def load_user(user_id):
     """
@@ -46,9 +90,134 @@ def load_user(user_id):
         user_id (int): The ID of the user to be loaded.
 
     Returns:
-        User: The user object if found, otherwise None.
+        CachedUser: The user if found, otherwise None.
     """
-    return User.query.get(int(user_id))
+    return load_cached_user(int(user_id))
+
+
+# Image listings are ordered newest first; id breaks ties between equal upload dates
+IMAGE_LISTING_ORDER = [Image.upload_date, Image.id]
+
+# Comments are listed newest first; id breaks ties between equal timestamps
+COMMENT_LISTING_ORDER = [Comment.timestamp, Comment.id]
+
+# Orderings offered by the sort option of the gallery and guest views
+IMAGE_SORT_ORDERS = {
+    "new": IMAGE_LISTING_ORDER,
+    "hot": [Image.hot_score, Image.id],
+    "top": [Image.vote_count, Image.id],
+}
+
+
+def paginate_images(query, order=IMAGE_LISTING_ORDER):
+    """
+    Returns one keyset-paginated page of an image listing query.
+
+    The image blob is deferred with raiseload, so listing pages never read
+    image bytes; templates fetch them separately through get_image. Uploaders
+    are joined into the same query so cards never lazy-load them one by one.
+
+    Args:
+        query (Query or list): The filtered image query, or several queries
+            (see images_with_status) whose pages are merged into one listing.
+        order (list): Ordering columns, most significant first, ending in Image.id.
+
+    Returns:
+        KeysetPage: The images on the requested page and the next cursor.
+    """
+    options = (defer(Image.image_data, raiseload=True), joinedload(Image.user))
+    cursor = request.args.get('cursor')
+    per_page = app.config["IMAGES_PER_PAGE"]
+    if isinstance(query, list):
+        return merged_keyset_page([q.options(*options) for q in query], order, cursor=cursor, per_page=per_page)
+    return keyset_page(query.options(*options), order, cursor=cursor, per_page=per_page)
+
+
+# One listing query per moderation status. Each reads its rows in upload order from
+# ix_image_status_upload or ix_image_status_category_upload, which an IN filter would not.
+def images_with_status(statuses, category=None):
+    queries = [Image.query.filter(Image.moderation_status == status) for status in statuses]
+    if category:
+        queries = [query.filter(Image.category == category) for query in queries]
+    return queries
+
+
+def paginate_followers(user_id):
+    """
+    Returns one keyset-paginated page of a user's followers, newest first.
+
+    Each row carries the follow's id (the page key) and the follower's id and
+    username, read with a single join on the followed_id index.
+
+    Args:
+        user_id (int): The user whose followers are listed.
+
+    Returns:
+        KeysetPage: The followers on the requested page and the next cursor.
+    """
+    query = (
+        db.session.query(Follower.id.label("follow_id"), User.id, User.username)
+        .join(User, User.id == Follower.follower_id)
+        .filter(Follower.followed_id == user_id)
+    )
+    return keyset_page(query, [Follower.id],
+                       cursor=request.args.get('cursor'),
+                       per_page=app.config["FOLLOWERS_PER_PAGE"],
+                       key=lambda row: [row.follow_id])
+
+
+def paginate_comments(image_id):
+    """
+    Returns one keyset-paginated page of an image's comments, newest first.
+
+    Each row carries the comment's id, content and timestamp and its
+    author's username, read with a single join on the (image_id, timestamp,
+    id) index, so no author is loaded separately.
+
+    Args:
+        image_id (int): The image whose comments are listed.
+
+    Returns:
+        KeysetPage: The comments on the requested page and the next cursor.
+    """
+    query = (
+        db.session.query(Comment.id, Comment.content, Comment.timestamp, User.username)
+        .join(User, User.id == Comment.user_id)
+        .filter(Comment.image_id == image_id)
+    )
+    return keyset_page(query, COMMENT_LISTING_ORDER,
+                       cursor=request.args.get('cursor'),
+                       per_page=app.config["COMMENTS_PER_PAGE"])
+
+
+def sort_images(query, sort):
+    """
+    Applies the sort option of the gallery and guest views to an image query.
+
+    Hot and top rank approved images only; they are read in order from the
+    status-prefixed ranking indexes, so the first page of a ranking costs
+    an index seek however many images there are.
+
+    Args:
+        query (Query): The filtered image query.
+        sort (str): 'new', 'hot' or 'top'.
+
+    Returns:
+        tuple: The query to paginate and its ordering columns.
+    """
+    if sort == "new":
+        return query, IMAGE_SORT_ORDERS["new"]
+    return query.filter(Image.moderation_status == "approved"), IMAGE_SORT_ORDERS[sort]
+
+
+# Builds the URL of another page of the current listing, keeping its filters
+@app.template_global()
+def url_for_page(cursor=None):
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    if cursor:
+        args['cursor'] = cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
 
 
 # Route for the homepage
@@ -104,7 +273,7 @@ def register():
         token = user.get_reset_token()
         verification_link = url_for('verify_email', token=token, _external=True)
 
-        # Send verification email
+        # Queue the verification email
         subject = "Verify Your Email"
         body = f"""
         Hello {user.username},
@@ -115,12 +284,9 @@ def register():
 
         If you did not request this, ignore this email.
         """
-        email_sent = send_email(user.email, subject, body)
+        enqueue_email(user.email, subject, body)
 
-        if email_sent:
-            flash('Registration successful! Please check your email to verify your account.', 'success')
-        else:
-            flash('Registration successful, but email failed to send.', 'danger')
+        flash('Registration successful! Please check your email to verify your account.', 'success')
 
         return redirect(url_for('login'))
 
@@ -147,6 +313,7 @@ def verify_email(token):
 
     # Mark user as verified and commit changes to the database
     user.is_verified = True
+    invalidate_user_cache()
     db.session.commit()
     
     flash('Your email has been verified! You can now log in.', 'success')
@@ -165,6 +332,7 @@ def verify_new_email(token, new_email):
 
     # Update email
     user.email = new_email
+    invalidate_user_cache()
     db.session.commit()
 
     flash('Your email has been updated successfully!', 'success')
@@ -233,8 +401,8 @@ def reset_password_request():
             reset_link = url_for('reset_password', token=token, _external=True)
             email_body = f"Hello {user.username},\n\nClick the link below to reset your password:\n\n{reset_link}\n\nIf you did not request this, ignore this email."
             
-            # Send reset email
-            send_email(user.email, "Password Reset Request", email_body)
+            # Queue the reset email
+            enqueue_email(user.email, "Password Reset Request", email_body)
 
             flash('A password reset email has been sent.', 'success')
         else:
@@ -260,6 +428,7 @@ def reset_password(token):
     if form.validate_on_submit():
         # Update user's password and commit changes
         user.set_password(form.password.data)
+        invalidate_user_cache()
         db.session.commit()
         flash('Your password has been reset! You can now log in.', 'success')
         return redirect(url_for('login'))
@@ -280,11 +449,11 @@ def change_email():
             flash('This email is already in use.', 'danger')
             return redirect(url_for('account'))
 
-        # Generate a verification token and send confirmation email
+        # Generate a verification token and queue the confirmation email
         token = current_user.get_reset_token()
         verification_link = url_for('verify_new_email', token=token, new_email=form.new_email.data, _external=True)
         email_body = f"Hello {current_user.username},\n\nClick the link below to confirm your new email:\n\n{verification_link}\n\nIf you did not request this, ignore this email."
-        send_email(form.new_email.data, "Confirm Your New Email", email_body)
+        enqueue_email(form.new_email.data, "Confirm Your New Email", email_body)
 
         flash('A confirmation email has been sent to your new address.', 'success')
         return redirect(url_for('account'))
@@ -306,6 +475,7 @@ def change_password():
 
         # Update password and save changes
         current_user.set_password(form.new_password.data)
+        invalidate_user_cache()
         db.session.commit()
         flash('Your password has been updated!', 'success')
         return redirect(url_for('account'))
@@ -339,15 +509,48 @@ def superuser_dashboard():
     selected_category = request.args.get('category', 'all')
     categories = ["Nature", "Art", "Technology", "Memes", "Photography"]
 
-    if selected_category == 'all':
-        images = Image.query.filter(Image.moderation_status.in_(["pending", "approved"])).all()
-    else:
-        images = Image.query.filter(
-            Image.moderation_status.in_(["pending", "approved"]),
-            Image.category == selected_category
-        ).all()
+    category = None if selected_category == 'all' else selected_category
+    page = paginate_images(images_with_status(["pending", "approved"], category))
+
+    return render_template('superuser_dashboard.html', images=page.items, next_cursor=page.next_cursor,
+                           selected_category=selected_category, categories=categories)
+
+
+# Route listing uploads flagged as possible duplicates (superuser only)
+@app.route('/superuser_dashboard/duplicates', methods=['GET'])
+@login_required
+def possible_duplicates():
+    if not current_user.is_superuser:
+        flash("Access Denied!", "danger")
+        return redirect(url_for('index'))
+
+    query = Image.query.filter(Image.duplicate_of_id.isnot(None)).options(
+        joinedload(Image.duplicate_of).defer(Image.image_data, raiseload=True))
+    page = paginate_images(query)
+
+    # Hamming distance of each flagged image to the image it resembles
+    distances = {
+        image.id: hamming_distance(image.phash, image.duplicate_of.phash)
+        for image in page.items if image.phash and image.duplicate_of.phash
+    }
 
-    return render_template('superuser_dashboard.html', images=images, selected_category=selected_category, categories=categories)
+    return render_template('possible_duplicates.html', images=page.items, next_cursor=page.next_cursor,
+                           distances=distances)
+
+
+# Route to clear the duplicate flag of an image that turned out to be distinct (superuser only)
+@app.route('/superuser_dashboard/duplicates/<int:image_id>/dismiss', methods=['POST'])
+@login_required
+def dismiss_duplicate(image_id):
+    if not current_user.is_superuser:
+        flash("Access Denied!", "danger")
+        return redirect(url_for('index'))
+
+    image = Image.query.get_or_404(image_id)
+    image.duplicate_of_id = None
+    db.session.commit()
+    flash(f"'{image.name}' is no longer marked as a possible duplicate.", "success")
+    return redirect(url_for('possible_duplicates'))
 
 
 # Route for uploading image
@@ -360,41 +563,122 @@ def upload_image():
         name = form.name.data
         file = form.image.data
 
-        # Open and process the uploaded image
-        img = PILImage.open(file)
-        img = img.resize((64, 64), PILImage.LANCZOS)
-        if img.mode != "RGBA":
-            img = img.convert("RGBA")
-        img_io = io.BytesIO()
-        img.save(img_io, format="PNG")
-        img_io.seek(0)
-        image_data = img_io.read()
-
-        # Create new image entry and save to database
-        image = Image(name=name, image_data=image_data, user_id=current_user.id)
+        # Decode, resize and encode every rendition in the worker pool, keeping CPU work off the request thread
+        original = file.read()
+        try:
+            processed = get_worker_pool().run(process_upload, original, app.config["IMAGE_MAX_PIXELS"],
+                                              app.config["RENDITION_SIZES"], app.config["RENDITION_FORMATS"],
+                                              timeout=app.config["IMAGE_PROCESSING_TIMEOUT"])
+        except ImageRejected as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('upload_image'))
+        except (PoolSaturated, WorkerTimeout, WorkerCrashed):
+            flash('The server is busy processing other uploads. Please try again shortly.', 'danger')
+            retry_after = str(app.config["UPLOAD_RETRY_AFTER"])
+            return render_template('upload_image.html', form=form), 503, {'Retry-After': retry_after}
+
+        # Look for an earlier upload that looks the same
+        duplicate = find_duplicate(processed.phash, app.config["DUPLICATE_MAX_DISTANCE"])
+        if duplicate and app.config["DUPLICATE_ACTION"] == "reject":
+            flash('This image looks like one that has already been uploaded.', 'danger')
+            return redirect(url_for('upload_image'))
+
+        # Store the image bytes in the blob store; the database only keeps the hashes and sizes
+        store = get_blob_store()
+        content_hash, content_size = store.put(processed.thumbnail)
+        original_hash, _ = store.put(original)
+
+        # Create new image entry with its renditions and save to database
+        upload_date = datetime.utcnow()
+        image = Image(name=name, content_hash=content_hash, content_size=content_size,
+                      original_hash=original_hash, original_format=processed.original_format,
+                      user_id=current_user.id, upload_date=upload_date, hot_score=hot_score(0, upload_date),
+                      phash=processed.phash, duplicate_of_id=duplicate.image_id if duplicate else None)
+        for size, fmt, data in processed.renditions:
+            rendition_hash, rendition_size = store.put(data)
+            image.renditions.append(ImageRendition(size=size, format=fmt, content_hash=rendition_hash,
+                                                   content_size=rendition_size))
         db.session.add(image)
+        db.session.flush()
+        index_image_hash(image.id, processed.phash)
         db.session.commit()
 
-        flash('Image uploaded successfully!', 'success')
+        if duplicate:
+            flash('Image uploaded! It looks like an existing image, so a moderator will review it.', 'warning')
+        else:
+            flash('Image uploaded successfully!', 'success')
         return redirect(url_for('upload_image'))
 
     return render_template('upload_image.html', form=form)
 
 
 
-# Route to retrieve an image from the database
+# Picks the rendition of an image to serve for a requested width and the request's Accept header
+def choose_rendition(image_id, requested_size):
+    renditions = db.session.query(
+        ImageRendition.size, ImageRendition.format, ImageRendition.content_hash
+    ).filter(ImageRendition.image_id == image_id).all()
+    if not renditions:
+        return None
+
+    # Smallest rendition at least as large as requested, or the largest there is
+    sizes = sorted({rendition.size for rendition in renditions})
+    size = next((s for s in sizes if s >= requested_size), sizes[-1])
+    by_format = {rendition.format: rendition for rendition in renditions if rendition.size == size}
+
+    # Prefer the most compact format the client accepts; PNG is the fallback for everyone else
+    offered = [RENDITION_MIMETYPES[fmt] for fmt in ("avif", "webp", "png") if fmt in by_format]
+    mimetype = None
+    if request.accept_mimetypes:
+        mimetype = request.accept_mimetypes.best_match(offered)
+    if mimetype is None:
+        mimetype = RENDITION_MIMETYPES["png"] if "png" in by_format else offered[-1]
+
+    fmt = next(fmt for fmt, value in RENDITION_MIMETYPES.items() if value == mimetype)
+    return by_format[fmt].content_hash, mimetype
+
+
+# Route to retrieve an image from the blob store
 @app.route('/image/<int:image_id>')
 def get_image(image_id):
-    # Fetch image from database, or return 404 if not found
-    image = Image.query.get_or_404(image_id)
+    """
+    Serves an image, or one of its renditions when a size is requested.
 
-    # Check if image contains image data
-    if not image.image_data:
-        flash("Image not found!", "danger")
-        return redirect(url_for('index'))
+    Query parameters:
+        size (int): Display width in pixels; the closest stored rendition at
+            least that large is served in the best format the client accepts.
+    """
+    # Fetch only the validators first, so cache revalidation never touches the blob
+    meta = db.session.query(Image.content_hash, Image.upload_date).filter(Image.id == image_id).first()
+    if meta is None:
+        abort(404)
+
+    content_hash, mimetype = meta.content_hash, 'image/png'
+    requested_size = request.args.get('size', type=int)
+    rendition = choose_rendition(image_id, requested_size) if requested_size else None
+    if rendition:
+        content_hash, mimetype = rendition
+
+    # Image bytes never change after upload, so the content hash is a strong ETag
+    cache_args = dict(etag=content_hash, last_modified=meta.upload_date,
+                      max_age=app.config["IMAGE_CACHE_MAX_AGE"], immutable=True)
+    if is_not_modified(content_hash, meta.upload_date):
+        response = not_modified_response(**cache_args)
+    elif content_hash:
+        # Serve from the blob store; a file path lets the server use sendfile
+        response = set_cache_headers(send_blob(content_hash, mimetype), **cache_args)
+    else:
+        # Images not yet moved by migrate-blobs still keep their data inline
+        image = Image.query.get_or_404(image_id)
+        if not image.image_data:
+            flash("Image not found!", "danger")
+            return redirect(url_for('index'))
+        response = set_cache_headers(Response(image.image_data, mimetype='image/png'), **cache_args)
 
-    # Return the image data as a response with PNG format
-    return Response(image.image_data, mimetype='image/png')   
+    # The format of a sized image depends on the Accept header
+    if requested_size:
+        response.vary.add('Accept')
+    return response
 
 
 # Route for superuser to moderate an image
@@ -418,14 +702,31 @@ def moderate_image(image_id):
     # Get the new moderation status and category from the form
     new_status = request.form.get('status')
     new_category = request.form.get('category')
+    old_category = image.category
 
     # Validate and update the image's moderation status
     if new_status in ["approved", "pending", "unmoderated"]:
+        was_approved = image.moderation_status == "approved"
         image.moderation_status = new_status
 
+        # Add the image to or remove it from the artist's stats when it enters or leaves approval
+        if (new_status == "approved") != was_approved:
+            db.session.flush()
+            if was_approved:
+                record_unapproval(image.user_id, image.id)
+            else:
+                record_approval(image.user_id, image.id)
+
         # Generate a unique number if the image is approved and doesn't already have one
         if new_status == "approved" and not image.unique_number:
-            image.unique_number = image.generate_unique_number()
+            image.unique_number = allocate_unique_number()
+
+        # Render the QR code once on approval; leaving approval invalidates it
+        if new_status == "approved":
+            if not image.qr_hash:
+                image.qr_hash = save_qr_code(image.unique_number)
+        else:
+            image.qr_hash = None
 
         # If an archived image is unmoderated, unarchive it
         if image.is_archived and new_status == "unmoderated":
@@ -444,10 +745,74 @@ def moderate_image(image_id):
 
     # Commit changes to the database
     db.session.commit()
+
+    # Guest listings only show approved images
+    if was_approved or new_status == "approved":
+        invalidate_listings(old_category, new_category)
     flash(f"Image '{image.name}' updated to {new_status}, Category: {new_category}.", "success")
     
     return redirect(url_for('edit_images'))
 
+# Route for superuser to moderate many images at once, from the edit page form or as JSON
+@app.route('/bulk_moderate', methods=['POST'])
+@login_required
+def bulk_moderate_images():
+    """
+    Applies a status, category and/or archive change to a list of images.
+
+    Accepts the edit page's form (image_ids checkboxes, status, category and
+    archive select fields, where an empty value keeps the current one) or a
+    JSON body {"image_ids": [...], "status": ..., "category": ...,
+    "archived": true/false}. JSON requests get a JSON response.
+    """
+    wants_json = request.is_json
+    if not current_user.is_superuser:
+        if wants_json:
+            return jsonify(success=False, error="Access Denied!"), 403
+        flash("Access Denied!", "danger")
+        return redirect(url_for('index'))
+
+    try:
+        if wants_json:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                raise BulkModerationError("The request body must be a JSON object.")
+            image_ids = data.get("image_ids")
+            if not isinstance(image_ids, list) or not all(
+                    isinstance(image_id, int) and not isinstance(image_id, bool) for image_id in image_ids):
+                raise BulkModerationError("image_ids must be a list of integers.")
+            status, category, archived = data.get("status"), data.get("category"), data.get("archived")
+            if not all(value is None or isinstance(value, str) for value in (status, category)):
+                raise BulkModerationError("status and category must be strings.")
+        else:
+            try:
+                image_ids = [int(image_id) for image_id in request.form.getlist("image_ids")]
+            except ValueError:
+                raise BulkModerationError("Image ids must be integers.")
+            status = request.form.get("status") or None
+            category = request.form.get("category") or None
+            archived = {"archive": True, "unarchive": False}.get(request.form.get("archive"))
+        if archived is not None and not isinstance(archived, bool):
+            raise BulkModerationError("archived must be true or false.")
+
+        updated = bulk_moderate(image_ids, status=status, category=category, archived=archived,
+                                max_images=app.config["BULK_MODERATION_MAX_IMAGES"])
+    except BulkModerationError as e:
+        db.session.rollback()
+        if wants_json:
+            return jsonify(success=False, error=str(e)), 400
+        flash(str(e), "danger")
+        return redirect(url_for('edit_images'))
+
+    db.session.commit()
+    if status is not None or category is not None:
+        invalidate_listings()
+    if wants_json:
+        return jsonify(success=True, updated=updated)
+    flash(f"Updated {updated} images.", "success")
+    return redirect(request.referrer or url_for('edit_images'))
+
+
 # Route for superuser to toggle archive status of an image
 @app.route('/toggle_archive/<int:image_id>', methods=['POST'])
 @login_required
@@ -537,13 +902,11 @@ def edit_images():
     selected_category = request.args.get('category', 'all')
     categories = ["Nature", "Art", "Technology", "Memes", "Photography"]
 
-    if selected_category == 'all':
-        images = Image.query.filter(Image.moderation_status.in_(["pending", "approved", "unmoderated"])).all()
-    else:
-        images = Image.query.filter(Image.moderation_status.in_(["pending", "approved", "unmoderated"]),
-                                    Image.category == selected_category).all()
+    category = None if selected_category == 'all' else selected_category
+    page = paginate_images(images_with_status(["pending", "approved", "unmoderated"], category))
 
-    return render_template('edit_images.html', images=images, selected_category=selected_category, categories=categories)
+    return render_template('edit_images.html', images=page.items, next_cursor=page.next_cursor,
+                           selected_category=selected_category, categories=categories)
 
 
 # Route to display archived images (only accessible by superuser)
@@ -558,19 +921,31 @@ def archived_images():
     categories = ["Nature", "Art", "Technology", "Memes", "Photography"]
 
     if selected_category == 'all':
-        images = Image.query.filter_by(is_archived=True).all()
+        query = Image.query.filter_by(is_archived=True)
     else:
-        images = Image.query.filter_by(is_archived=True, category=selected_category).all()
+        query = Image.query.filter_by(is_archived=True, category=selected_category)
+    page = paginate_images(query)
+
+    return render_template('archived_images.html', images=page.items, next_cursor=page.next_cursor,
+                           selected_category=selected_category, categories=categories)
 
-    return render_template('archived_images.html', images=images, selected_category=selected_category, categories=categories)
+
+# Renders a QR code for a unique number and stores it in the blob store
+def save_qr_code(unique_number):
+    content_hash, _ = get_blob_store().put(render_qr_png(unique_number))
+    return content_hash
 
 
 @app.route('/generate_qr/<int:image_id>')
 def generate_qr(image_id):
-    """ Generates a QR code for an image if it is approved and has a unique number. """
+    """ Serves the stored QR code for an image if it is approved and has a unique number. """
 
-    # Fetch the image by ID or return a 404 error if not found
-    image = Image.query.get_or_404(image_id)
+    # Fetch only the fields needed for the QR code, or return a 404 error if not found
+    image = db.session.query(
+        Image.id, Image.moderation_status, Image.unique_number, Image.qr_hash
+    ).filter(Image.id == image_id).first()
+    if image is None:
+        abort(404)
 
     # Ensure the image is approved before generating a QR code
     if image.moderation_status != "approved":
@@ -582,28 +957,20 @@ def generate_qr(image_id):
         flash("This image does not have a unique number yet.", "danger")
         return redirect(url_for('view_all_images'))
 
-    # Create a QR code instance with error correction and size settings
-    qr = qrcode.QRCode(
-        version=1,  
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=5,  
-        border=2  
-    )
-
-    # Add the image's unique number to the QR code
-    qr.add_data(f"Image ID: {image.unique_number}")
-    qr.make(fit=True)
-
-    # Generate the QR code image
-    img = qr.make_image(fill="black", back_color="white")
+    cache_args = dict(etag=image.qr_hash, max_age=app.config["QR_CACHE_MAX_AGE"])
+    if image.qr_hash and is_not_modified(image.qr_hash):
+        return not_modified_response(**cache_args)
 
-    # Save the QR code image in memory as a PNG
-    img_io = BytesIO()
-    img.save(img_io, "PNG")
-    img_io.seek(0)  # Reset the stream position
+    # Images approved before QR codes were stored get theirs on first request
+    qr_hash = image.qr_hash
+    if not qr_hash:
+        qr_hash = save_qr_code(image.unique_number)
+        Image.query.filter_by(id=image.id, qr_hash=None).update({"qr_hash": qr_hash})
+        db.session.commit()
+        cache_args["etag"] = qr_hash
 
-    # Return the QR code as a downloadable image response
-    return send_file(img_io, mimetype='image/png')
+    # Return the stored QR code image
+    return set_cache_headers(send_blob(qr_hash, 'image/png'), **cache_args)
 
 
 
@@ -614,6 +981,25 @@ def user_active_images():
     return render_template('active_images.html')
 
 
+# Route to download all of an artist's images as one ZIP, streamed as it is built
+@app.route('/user/<int:user_id>/images.zip', methods=['GET'])
+@login_required
+def download_images(user_id):
+    # Artists can download their own images; superusers anyone's
+    if user_id != current_user.id and not current_user.is_superuser:
+        flash("Access Denied!", "danger")
+        return redirect(url_for('account'))
+
+    username = db.session.query(User.username).filter(User.id == user_id).scalar()
+    if username is None:
+        abort(404)
+
+    response = Response(stream_with_context(stream_portfolio(user_id, get_blob_store())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(username) or "artist"}-images.zip"'
+    response.cache_control.no_store = True
+    return response
+
+
 # Route to display a user's moderated images
 @app.route('/user_moderated_images', methods=['GET'])
 @login_required
@@ -627,15 +1013,40 @@ def user_moderated_images():
 def view_all_images():
     selected_category = request.args.get('category', 'all')
     categories = ["Nature", "Art", "Technology", "Memes", "Photography"]
+    selected_sort = request.args.get('sort', 'new')
+    if selected_sort not in IMAGE_SORT_ORDERS:
+        selected_sort = 'new'
 
     if selected_category == 'all':
-        images = Image.query.all()
+        query = Image.query
     else:
-        images = Image.query.filter_by(category=selected_category).all()
-
-    user_votes = {vote.image_id: vote.vote_type for vote in Vote.query.filter_by(user_id=current_user.id).all()}
+        query = Image.query.filter_by(category=selected_category)
+    page = paginate_images(*sort_images(query, selected_sort))
+
+    # Only look up the current user's votes for the images on this page
+    image_ids = [image.id for image in page.items]
+    user_votes = {}
+    if image_ids:
+        user_votes = {
+            vote.image_id: vote.vote_type
+            for vote in Vote.query.filter(Vote.user_id == current_user.id, Vote.image_id.in_(image_ids))
+        }
+        vote_buffer = get_vote_buffer()
+        if vote_buffer:
+            user_votes.update(vote_buffer.pending_votes(current_user.id, image_ids))
+
+    # Follow state for every uploader on the page in one query; follower counts are stored on the user
+    uploader_ids = {image.user_id for image in page.items}
+    following = set()
+    if uploader_ids:
+        following = {
+            followed_id for (followed_id,) in db.session.query(Follower.followed_id).filter(
+                Follower.follower_id == current_user.id, Follower.followed_id.in_(uploader_ids))
+        }
 
-    return render_template("view_all_images.html", images=images, user_votes=user_votes, selected_category=selected_category, categories=categories)
+    return render_template("view_all_images.html", images=page.items, next_cursor=page.next_cursor, user_votes=user_votes,
+                           following=following, selected_sort=selected_sort,
+                           selected_category=selected_category, categories=categories)
 
 
 # Allowed file types for image uploads
@@ -650,37 +1061,23 @@ def allowed_file(filename):
 @app.route("/vote/<int:image_id>/<vote_type>", methods=["POST"])
 @login_required
 def vote(image_id, vote_type):
-    image = Image.query.get_or_404(image_id)
+    if vote_type not in VOTE_VALUES:
+        return jsonify(success=False, error="Invalid vote type."), 400
 
-    # Find existing vote from the current user
-    existing_vote = Vote.query.filter_by(user_id=current_user.id, image_id=image_id).first()
+    # Check the image exists without loading it
+    db.session.query(Image.id).filter(Image.id == image_id).first_or_404()
 
-    if existing_vote:
-        if existing_vote.vote_type == vote_type:
-            # If the user clicks the same vote again, remove the vote
-            db.session.delete(existing_vote)
-            db.session.commit()
-
-            # Update vote count after removing the vote
-            image.vote_count = Vote.query.filter_by(image_id=image_id, vote_type="upvote").count() - \
-                                 Vote.query.filter_by(image_id=image_id, vote_type="downvote").count()
-
-            db.session.commit()
-            return jsonify(success=True, new_vote_count=image.vote_count, user_vote=None)
-        else:
-            # If switching votes, update vote type
-            existing_vote.vote_type = vote_type
-    else:
-        # If no previous vote, create a new one
-        new_vote = Vote(user_id=current_user.id, image_id=image_id, vote_type=vote_type)
-        db.session.add(new_vote)
-
-    # Update the vote count based on the new voting state
-    image.vote_count = Vote.query.filter_by(image_id=image_id, vote_type="upvote").count() - \
-                         Vote.query.filter_by(image_id=image_id, vote_type="downvote").count()
+    # With vote buffering on, answer from memory and let the buffer write in batches
+    vote_buffer = get_vote_buffer()
+    if vote_buffer:
+        new_vote_count, user_vote = vote_buffer.vote(current_user.id, image_id, vote_type)
+        return jsonify(success=True, new_vote_count=new_vote_count, user_vote=user_vote)
 
+    # Toggle the vote and adjust the count by the change, in one transaction
+    new_vote_count, user_vote = toggle_vote(current_user.id, image_id, vote_type)
     db.session.commit()
-    return jsonify(success=True, new_vote_count=image.vote_count, user_vote=vote_type)
+
+    return jsonify(success=True, new_vote_count=new_vote_count, user_vote=user_vote)
 
 # Route for resetting votes on an image (Superuser only)
 @app.route('/reset_votes/<int:image_id>', methods=['POST'])
@@ -697,15 +1094,31 @@ def reset_votes(image_id):
         flash("You must provide a reason for resetting votes.", "danger")
         return redirect(url_for('edit_images'))
 
+    # Buffered votes must not be written back after the reset
+    vote_buffer = get_vote_buffer()
+    if vote_buffer:
+        vote_buffer.discard_image(image.id)
+
     # Reset the vote count and store the reset reason
+    old_count = image.vote_count or 0
     image.vote_count = 0
+    image.hot_score = hot_score(0, image.upload_date)
     image.last_reset_date = datetime.utcnow()
     image.last_reset_reason = reset_reason
+    db.session.flush()
+
+    # Take the image's votes out of the artist's stats; a new top image is looked up from the flushed counts
+    if image.moderation_status == "approved":
+        record_vote_change(image.user_id, image.id, -old_count, 0)
 
     # Remove all votes associated with this image
     Vote.query.filter_by(image_id=image.id).delete()
 
     db.session.commit()
+
+    # Hot and top guest listings order approved images by their votes
+    if image.moderation_status == "approved":
+        invalidate_listings(image.category)
     flash(f"Votes for '{image.name}' have been reset to 0. Users can now vote again.", "success")
     return redirect(url_for('edit_images'))
 
@@ -715,30 +1128,96 @@ def reset_votes(image_id):
 def guest_view():
     selected_category = request.args.get('category', 'all')
     categories = ["Nature", "Art", "Technology", "Memes", "Photography"]
+    selected_sort = request.args.get('sort', 'new')
+    if selected_sort not in IMAGE_SORT_ORDERS:
+        selected_sort = 'new'
 
     if selected_category == 'all':
-        images = Image.query.filter(Image.moderation_status == "approved").all()
+        query = Image.query.filter(Image.moderation_status == "approved")
+    else:
+        query = Image.query.filter(Image.moderation_status == "approved", Image.category == selected_category)
+
+    def render_grid():
+        page = paginate_images(*sort_images(query, selected_sort))
+        return render_template('guest_image_grid.html', images=page.items, next_cursor=page.next_cursor)
+
+    # The grid is the same for every visitor, so it is cached; the page around it is not (navigation, flashes).
+    # Requests with other arguments are rendered uncached, as their pagination links would differ.
+    cache = get_fragment_cache()
+    if (cache is not None and selected_category in ['all'] + categories
+            and set(request.args) <= {'category', 'sort', 'cursor'}):
+        key = f"guest_view|{selected_category}|{selected_sort}|{request.args.get('cursor', '')}"
+        image_grid = cache.get_or_render(key, [listing_tag(selected_category)], render_grid)
     else:
-        images = Image.query.filter(Image.moderation_status == "approved", Image.category == selected_category).all()
+        image_grid = render_grid()
+
+    return render_template('guest_view.html', image_grid=Markup(image_grid),
+                           selected_sort=selected_sort, selected_category=selected_category, categories=categories)
+
+
+# Route for superuser to see how well the fragment cache is doing in this process
+@app.route('/cache_stats', methods=['GET'])
+@login_required
+def cache_stats():
+    if not current_user.is_superuser:
+        return jsonify(success=False, error="Access Denied!"), 403
+    cache = get_fragment_cache()
+    return jsonify(enabled=cache is not None, **(cache.stats() if cache else {}))
+
+
+# Loads an artist's stats row together with their top image, or None if they have no approved images yet
+def load_artist_stats(user_id):
+    return (
+        ArtistStats.query.options(joinedload(ArtistStats.top_image).defer(Image.image_data, raiseload=True))
+        .filter(ArtistStats.user_id == user_id)
+        .first()
+    )
 
-    return render_template('guest_view.html', images=images, selected_category=selected_category, categories=categories)
+
+# Route to search images by name, artist and comments
+@app.route('/search', methods=['GET'])
+def search():
+    query_text = request.args.get('q', '').strip()
+    categories = ["Nature", "Art", "Technology", "Memes", "Photography"]
+    statuses = ["approved", "pending", "unmoderated"]
+
+    selected_category = request.args.get('category', 'all')
+    if selected_category not in categories:
+        selected_category = 'all'
+
+    # Guests only ever see approved images; signed-in users can filter by status like the gallery
+    selected_status = 'approved'
+    if current_user.is_authenticated:
+        selected_status = request.args.get('status', 'all')
+        if selected_status not in statuses:
+            selected_status = 'all'
+
+    page = search_images(query_text,
+                         category=None if selected_category == 'all' else selected_category,
+                         status=None if selected_status == 'all' else selected_status,
+                         cursor=request.args.get('cursor'),
+                         per_page=app.config["IMAGES_PER_PAGE"])
+
+    return render_template('search.html', images=page.items, next_cursor=page.next_cursor, query=query_text,
+                           selected_category=selected_category, categories=categories,
+                           selected_status=selected_status, statuses=statuses)
 
 
 # Route to display the profile of the logged-in user
 @app.route('/profile')
 @login_required
 def profile():
-    # Fetch list of users following the current user
-    followers = [follower.follower for follower in current_user.followers_list]
+    # Fetch the first page of users following the current user
+    followers = paginate_followers(current_user.id)
 
-    # Retrieve the user's most upvoted approved image
-    most_upvoted_image = (
-        Image.query.filter_by(user_id=current_user.id, moderation_status="approved")
-        .order_by(Image.vote_count.desc())
-        .first()
-    )
+    # Read the user's stats and most upvoted approved image from one precomputed row
+    stats = load_artist_stats(current_user.id)
 
-    return render_template('profile.html', user=current_user, followers=followers, most_upvoted_image=most_upvoted_image)
+    # The page shows the user's follow counts, which the cached current_user does not hold
+    user = db.session.get(User, current_user.id)
+    return render_template('profile.html', user=user, followers=followers.items,
+                           next_cursor=followers.next_cursor, stats=stats,
+                           most_upvoted_image=stats.top_image if stats else None, is_following=False)
 
 
 # Route to follow a user
@@ -749,8 +1228,8 @@ def follow_user(user_id):
 
     # Ensure the user is not following themselves and that the user is not a superuser
     if user != current_user and not user.is_superuser:
-        follow = Follower(follower_id=current_user.id, followed_id=user.id)  
-        db.session.add(follow)
+        # Following twice is a no-op, so the counters only move on the first follow
+        follow(current_user.id, user.id)
         db.session.commit()
         flash(f"You are now following {user.username}.", "success")
 
@@ -763,10 +1242,8 @@ def follow_user(user_id):
 def unfollow_user(user_id):
     user = User.query.get_or_404(user_id)
 
-    # Check if the user is already following the user
-    follow = Follower.query.filter_by(follower_id=current_user.id, followed_id=user.id).first()  
-    if follow:
-        db.session.delete(follow)
+    # Remove the follow if there is one, adjusting both users' counters
+    if unfollow(current_user.id, user.id):
         db.session.commit()
         flash(f"You have unfollowed {user.username}.", "success")
 
@@ -778,39 +1255,53 @@ def unfollow_user(user_id):
 def public_profile(user_id):
     user = User.query.get_or_404(user_id)
 
-    # Retrieve list of followers for the user
-    followers = [follower.follower for follower in user.followers_list]
+    # Retrieve the first page of the user's followers
+    followers = paginate_followers(user.id)
 
-    # Fetch the user's most upvoted approved image
-    most_upvoted_image = (
-        Image.query.filter_by(user_id=user.id, moderation_status="approved")
-        .order_by(Image.vote_count.desc())
-        .first()
-    )
+    # Read the user's stats and most upvoted approved image from one precomputed row
+    stats = load_artist_stats(user.id)
 
-    # Determine if the current user follows the user
-    following = set()
+    # Determine if the current user follows the user, with a lookup on the unique follow index
+    is_following = False
     if current_user.is_authenticated:
-        following = {follow.followed_id for follow in current_user.following}
+        is_following = db.session.query(Follower.id).filter_by(
+            follower_id=current_user.id, followed_id=user.id).first() is not None
+
+    return render_template('profile.html', user=user, followers=followers.items, next_cursor=followers.next_cursor,
+                           stats=stats, most_upvoted_image=stats.top_image if stats else None,
+                           is_following=is_following)
+
 
-    return render_template('profile.html', user=user, followers=followers, most_upvoted_image=most_upvoted_image, following=following)
+# Route returning further pages of a user's followers as JSON
+@app.route('/profile/<int:user_id>/followers.json')
+def followers_json(user_id):
+    db.session.query(User.id).filter(User.id == user_id).first_or_404()
+    page = paginate_followers(user_id)
+
+    followers = [
+        {"id": row.id, "username": row.username, "profile_url": url_for('public_profile', user_id=row.id)}
+        for row in page.items
+    ]
+    return jsonify(followers=followers, next_cursor=page.next_cursor)
 
 
 # Route to view and post comments on an image
 @app.route('/image/<int:image_id>/comments', methods=['GET', 'POST'])
 def view_comments(image_id):
-    image = Image.query.get_or_404(image_id)
+    image = Image.query.options(joinedload(Image.user)).filter(Image.id == image_id).first_or_404()
 
     # Ensure comments are only available for moderated image
     if image.moderation_status != "approved":
         flash("Comments are only available for moderated images.", "danger")
         return redirect(url_for('view_all_images'))
 
-    # Retrieve all comments for the image, sorted by latest first
-    comments = Comment.query.filter_by(image_id=image.id).order_by(Comment.timestamp.desc()).all()
-
+    # Posting never needs the comment listing, so it is handled before any comments are read
     if request.method == 'POST':
-        content = request.form.get('content')
+        if not current_user.is_authenticated:
+            flash("Log in to comment.", "danger")
+            return redirect(url_for('login'))
+
+        content = request.form.get('content') or ''
 
         # Ensure the comment is not empty
         if not content.strip():
@@ -825,7 +1316,29 @@ def view_comments(image_id):
 
         return redirect(url_for('view_comments', image_id=image.id))
 
-    return render_template('comments.html', image=image, comments=comments)
+    # Retrieve one page of comments with their authors, latest first
+    page = paginate_comments(image.id)
+    return render_template('comments.html', image=image, comments=page.items, next_cursor=page.next_cursor)
+
+
+# Route returning further pages of an image's comments as JSON
+@app.route('/image/<int:image_id>/comments.json')
+def comments_json(image_id):
+    db.session.query(Image.id).filter(Image.id == image_id, Image.moderation_status == "approved").first_or_404()
+    page = paginate_comments(image_id)
+
+    can_delete = current_user.is_authenticated and current_user.is_superuser
+    comments = [
+        {
+            "id": row.id,
+            "username": row.username,
+            "content": row.content,
+            "timestamp": row.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            "delete_url": url_for('delete_comment', comment_id=row.id) if can_delete else None,
+        }
+        for row in page.items
+    ]
+    return jsonify(comments=comments, next_cursor=page.next_cursor)
 
 
 # Route to delete a comment (Only accessible to superusers)
@@ -0,0 +1,180 @@
+import re
+
+from sqlalchemy import Float, column, func, literal_column, or_, select, table, union_all
+from sqlalchemy.orm import defer, joinedload
+
+from models import db, Image, User
+from pagination import KeysetPage, keyset_page
+
+
+# FTS5 index of image names and artist usernames, one row per image (rowid = image id)
+image_search = table("image_search", column("rowid"))
+
+# FTS5 index of comment text, one row per comment (rowid = comment id) pointing back at its image
+comment_search = table("comment_search", column("rowid"), column("image_id"))
+
+# BM25 weights of the name and artist columns: a match in the title counts most
+SEARCH_COLUMN_WEIGHTS = (10.0, 5.0)
+
+# BM25 weight of a comment match, below both image columns
+COMMENT_WEIGHT = 1.0
+
+# The indexes and the triggers that keep them in sync with the image, user and comment tables.
+# Comments are indexed as their own rows, so writing one only touches that comment's row.
+SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE image_search USING fts5(
+        name, artist,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    """CREATE VIRTUAL TABLE comment_search USING fts5(
+        content, image_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    """CREATE TRIGGER image_search_insert AFTER INSERT ON image BEGIN
+        INSERT INTO image_search (rowid, name, artist)
+        VALUES (new.id, new.name, (SELECT username FROM user WHERE id = new.user_id));
+    END""",
+    """CREATE TRIGGER image_search_delete AFTER DELETE ON image BEGIN
+        DELETE FROM image_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER image_search_update AFTER UPDATE OF name, user_id ON image BEGIN
+        UPDATE image_search
+        SET name = new.name, artist = (SELECT username FROM user WHERE id = new.user_id)
+        WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER image_search_rename AFTER UPDATE OF username ON user BEGIN
+        UPDATE image_search SET artist = new.username
+        WHERE rowid IN (SELECT id FROM image WHERE user_id = new.id);
+    END""",
+    """CREATE TRIGGER comment_search_insert AFTER INSERT ON comment BEGIN
+        INSERT INTO comment_search (rowid, content, image_id) VALUES (new.id, new.content, new.image_id);
+    END""",
+    """CREATE TRIGGER comment_search_delete AFTER DELETE ON comment BEGIN
+        DELETE FROM comment_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER comment_search_update AFTER UPDATE OF content, image_id ON comment BEGIN
+        UPDATE comment_search SET content = new.content, image_id = new.image_id WHERE rowid = new.id;
+    END""",
+]
+
+
+def create_search_index(connection):
+    """Creates the search index and its triggers and fills it. SQLite only."""
+    for statement in SEARCH_SCHEMA:
+        connection.exec_driver_sql(statement)
+    rebuild_search_index(connection)
+
+
+def drop_search_index(connection):
+    """Drops the search indexes and their triggers, e.g. before a bulk load. SQLite only."""
+    triggers = connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        " AND (name LIKE 'image_search_%' OR name LIKE 'comment_search_%')"
+    ).scalars().all()
+    for name in triggers:
+        connection.exec_driver_sql(f'DROP TRIGGER "{name}"')
+    connection.exec_driver_sql("DROP TABLE IF EXISTS image_search")
+    connection.exec_driver_sql("DROP TABLE IF EXISTS comment_search")
+
+
+def rebuild_search_index(connection):
+    """Refills the search indexes from the image, user and comment tables."""
+    connection.exec_driver_sql("DELETE FROM image_search")
+    connection.exec_driver_sql("""
+        INSERT INTO image_search (rowid, name, artist)
+        SELECT image.id, image.name, user.username
+        FROM image JOIN user ON user.id = image.user_id
+    """)
+    connection.exec_driver_sql("DELETE FROM comment_search")
+    connection.exec_driver_sql("""
+        INSERT INTO comment_search (rowid, content, image_id)
+        SELECT id, content, image_id FROM comment
+    """)
+
+
+def build_match_query(text):
+    """
+    Turns what a user typed into an FTS5 query.
+
+    Every word must match, each as a prefix, so "sun bea" finds
+    "Sunset on the beach". Only word characters are kept and each term is
+    quoted, so FTS5 operators and syntax errors cannot be injected.
+
+    Returns:
+        str: The MATCH expression, or an empty string if there are no words.
+    """
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", text))
+
+
+def search_images(text, category=None, status=None, cursor=None, per_page=50):
+    """
+    Returns one page of images matching a search, best match first.
+
+    An image matches when every word is found in its name and artist, or in
+    one of its comments. Matches are ranked by the BM25 scores of the image
+    and its matching comments added up, and paged by (score, id) with a
+    keyset cursor. Image data is deferred with
+    raiseload and uploaders are joined, as on the other listings.
+
+    Args:
+        text (str): The search as typed by the user.
+        category (str): Only return images in this category, if given.
+        status (str): Only return images with this moderation status, if given.
+        cursor (str): Cursor returned with the previous page, if any.
+        per_page (int): Maximum number of images on the page.
+
+    Returns:
+        KeysetPage: The matching images and the cursor of the next page.
+    """
+    match = build_match_query(text)
+    if not match:
+        return KeysetPage([], None)
+
+    options = (defer(Image.image_data, raiseload=True), joinedload(Image.user))
+
+    if db.engine.dialect.name != "sqlite":
+        # Without FTS5, fall back to matching names and artists, newest first
+        pattern = f"%{text.strip()}%"
+        query = (
+            db.session.query(Image).options(*options)
+            .join(User, User.id == Image.user_id)
+            .filter(or_(Image.name.ilike(pattern), User.username.ilike(pattern)))
+        )
+    else:
+        # Image and comment matches, one row each, with BM25 ranks (lower is better)
+        matches = union_all(
+            select(image_search.c.rowid.label("image_id"),
+                   func.bm25(literal_column("image_search"), *SEARCH_COLUMN_WEIGHTS, type_=Float).label("rank"))
+            .where(literal_column("image_search").op("MATCH")(match)),
+            select(comment_search.c.image_id,
+                   func.bm25(literal_column("comment_search"), COMMENT_WEIGHT, type_=Float))
+            .where(literal_column("comment_search").op("MATCH")(match)),
+        ).subquery("matches")
+        ranked = (
+            select(matches.c.image_id, func.sum(matches.c.rank).label("rank"))
+            .group_by(matches.c.image_id)
+            .subquery("ranked")
+        )
+
+        # Higher is better, so the score can be paged newest-first style like the other listings
+        score = (-ranked.c.rank).label("score")
+        query = (
+            db.session.query(Image).options(*options)
+            .select_from(ranked)
+            .join(Image, Image.id == ranked.c.image_id)
+            .add_columns(score)
+        )
+
+    if category:
+        query = query.filter(Image.category == category)
+    if status:
+        query = query.filter(Image.moderation_status == status)
+
+    if db.engine.dialect.name != "sqlite":
+        return keyset_page(query, [Image.upload_date, Image.id], cursor=cursor, per_page=per_page)
+
+    page = keyset_page(query, [score, Image.id], cursor=cursor, per_page=per_page,
+                       key=lambda row: [row.score, row.Image.id])
+    return page._replace(items=[row.Image for row in page.items])
@@ -0,0 +1,56 @@
+/**
+ * Loads older comments on an image without reloading the page.
+ * Without JavaScript the "More Comments" link simply opens the next page.
+ */
+
+document.addEventListener("DOMContentLoaded", function () {
+    const moreLink = document.getElementById("more-comments");
+    const list = document.getElementById("comment-list");
+
+    if (!moreLink || !list) return; // Only images with more than one page of comments have the link
+
+    moreLink.addEventListener("click", function (event) {
+        event.preventDefault();
+
+        // Request the page after the last comment shown
+        const url = new URL(moreLink.dataset.url, window.location.origin);
+        url.searchParams.set("cursor", moreLink.dataset.cursor);
+
+        fetch(url, { headers: { "X-Requested-With": "XMLHttpRequest" } })
+            .then(response => response.json())
+            .then(data => {
+                // Append each comment with its author and time, as the page renders them
+                data.comments.forEach(comment => {
+                    const item = document.createElement("li");
+                    const author = document.createElement("strong");
+                    author.textContent = comment.username;
+                    item.appendChild(author);
+                    item.appendChild(document.createTextNode(`: ${comment.content} (${comment.timestamp})`));
+
+                    // Superusers also get a delete button
+                    if (comment.delete_url) {
+                        const form = document.createElement("form");
+                        form.method = "POST";
+                        form.action = comment.delete_url;
+                        form.style.display = "inline";
+                        const button = document.createElement("button");
+                        button.type = "submit";
+                        button.textContent = "Delete";
+                        button.setAttribute("aria-label", `Delete comment by ${comment.username}`);
+                        form.appendChild(document.createTextNode(" "));
+                        form.appendChild(button);
+                        item.appendChild(form);
+                    }
+                    list.appendChild(item);
+                });
+
+                // Remember where the next page starts, or remove the link after the last page
+                if (data.next_cursor) {
+                    moreLink.dataset.cursor = data.next_cursor;
+                } else {
+                    moreLink.remove();
+                }
+            })
+            .catch(error => console.error("Error:", error)); // Handle request errors
+    });
+});
@@ -0,0 +1,41 @@
+/**
+ * Loads further pages of a profile's follower list without reloading the page.
+ * Without JavaScript the "More Followers" link simply opens the next page.
+ */
+
+document.addEventListener("DOMContentLoaded", function () {
+    const moreLink = document.getElementById("more-followers");
+    const list = document.getElementById("follower-list");
+
+    if (!moreLink || !list) return; // Only profiles with more than one page of followers have the link
+
+    moreLink.addEventListener("click", function (event) {
+        event.preventDefault();
+
+        // Request the page after the last follower shown
+        const url = new URL(moreLink.dataset.url, window.location.origin);
+        url.searchParams.set("cursor", moreLink.dataset.cursor);
+
+        fetch(url, { headers: { "X-Requested-With": "XMLHttpRequest" } })
+            .then(response => response.json())
+            .then(data => {
+                // Append each follower as a link to their profile
+                data.followers.forEach(follower => {
+                    const item = document.createElement("li");
+                    const link = document.createElement("a");
+                    link.href = follower.profile_url;
+                    link.textContent = follower.username;
+                    item.appendChild(link);
+                    list.appendChild(item);
+                });
+
+                // Remember where the next page starts, or remove the link after the last page
+                if (data.next_cursor) {
+                    moreLink.dataset.cursor = data.next_cursor;
+                } else {
+                    moreLink.remove();
+                }
+            })
+            .catch(error => console.error("Error:", error)); // Handle request errors
+    });
+});
@@ -0,0 +1,129 @@
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import aliased
+
+from database import insert_if_absent
+from models import db, ArtistStats, Image
+
+
+# Creates an artist's stats row if it does not exist yet
+def _ensure_stats_row(user_id):
+    db.session.execute(insert_if_absent(
+        db.engine, ArtistStats, ["user_id"], user_id=user_id, top_image_votes=0, approved_count=0, total_votes=0,
+    ))
+
+
+# Sets an artist's stats row with the given changes
+def _update_stats(user_id, **values):
+    return db.session.execute(
+        update(ArtistStats).where(ArtistStats.user_id == user_id).values(**values)
+        .returning(ArtistStats.top_image_id, ArtistStats.top_image_votes),
+        execution_options={"synchronize_session": False},
+    ).one()
+
+
+# Finds the artist's most upvoted approved image again, with one seek on ix_image_user_status_votes
+def _refresh_top_image(user_id):
+    top = db.session.execute(
+        select(Image.id, Image.vote_count)
+        .where(Image.user_id == user_id, Image.moderation_status == "approved")
+        .order_by(Image.vote_count.desc(), Image.id.desc())
+        .limit(1)
+    ).first()
+    _update_stats(user_id, top_image_id=top.id if top else None, top_image_votes=(top.vote_count or 0) if top else 0)
+
+
+def record_vote_change(user_id, image_id, delta, new_count):
+    """
+    Updates an artist's stats after the vote count of one of their approved
+    images changed by delta to new_count.
+
+    A rising count can only make the image the new top image; a falling
+    count of the current top image means looking the top image up again,
+    so the new count must already be flushed. Does not commit.
+    """
+    if delta == 0:
+        return
+
+    _ensure_stats_row(user_id)
+    top_image_id, top_votes = _update_stats(user_id, total_votes=ArtistStats.total_votes + delta)
+
+    if top_image_id == image_id:
+        if delta > 0:
+            _update_stats(user_id, top_image_votes=new_count)
+        else:
+            _refresh_top_image(user_id)
+    elif top_image_id is None or new_count > top_votes:
+        _update_stats(user_id, top_image_id=image_id, top_image_votes=new_count)
+
+
+def record_approval(user_id, image_id):
+    """
+    Adds a newly approved image to its artist's stats. Must be called after
+    the status change was flushed. Does not commit.
+    """
+    count = db.session.execute(select(Image.vote_count).where(Image.id == image_id)).scalar() or 0
+
+    _ensure_stats_row(user_id)
+    top_image_id, top_votes = _update_stats(
+        user_id,
+        approved_count=ArtistStats.approved_count + 1,
+        total_votes=ArtistStats.total_votes + count,
+    )
+    if top_image_id is None or count > top_votes:
+        _update_stats(user_id, top_image_id=image_id, top_image_votes=count)
+
+
+def record_unapproval(user_id, image_id):
+    """
+    Removes an image that is no longer approved from its artist's stats.
+    Must be called after the status change was flushed. Does not commit.
+    """
+    count = db.session.execute(select(Image.vote_count).where(Image.id == image_id)).scalar() or 0
+
+    _ensure_stats_row(user_id)
+    top_image_id, _ = _update_stats(
+        user_id,
+        approved_count=ArtistStats.approved_count - 1,
+        total_votes=ArtistStats.total_votes - count,
+    )
+    if top_image_id == image_id:
+        _refresh_top_image(user_id)
+
+
+def rebuild_artist_stats(connection, user_ids=None):
+    """
+    Recomputes artists' stats from the image table with one DELETE and one
+    INSERT ... SELECT.
+
+    Args:
+        connection: A Connection or Session to run the statements on.
+        user_ids (list): Only rebuild these artists; all artists if None.
+    """
+    image = aliased(Image)
+    top = aliased(Image)
+    top_image_id = (
+        select(top.id)
+        .where(top.user_id == image.user_id, top.moderation_status == "approved")
+        .order_by(top.vote_count.desc(), top.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    totals = (
+        select(
+            image.user_id,
+            top_image_id,
+            func.coalesce(func.max(image.vote_count), 0),
+            func.count(),
+            func.coalesce(func.sum(image.vote_count), 0),
+        )
+        .where(image.moderation_status == "approved")
+        .group_by(image.user_id)
+    )
+    clear = delete(ArtistStats)
+    if user_ids is not None:
+        totals = totals.where(image.user_id.in_(user_ids))
+        clear = clear.where(ArtistStats.user_id.in_(user_ids))
+
+    connection.execute(clear)
+    connection.execute(insert(ArtistStats).from_select(
+        ["user_id", "top_image_id", "top_image_votes", "approved_count", "total_votes"], totals))
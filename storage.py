@@ -0,0 +1,133 @@
+import hashlib
+import os
+import tempfile
+
+from flask import current_app, send_file
+
+
+class BlobStore:
+    """
+    Base class for content-addressed blob storage backends.
+
+    Blobs are identified by the hex SHA-256 digest of their content, so
+    storing the same bytes twice keeps a single copy and a digest always
+    refers to the same bytes.
+    """
+
+    def put(self, data):
+        """
+        Stores a blob.
+
+        Args:
+            data (bytes): The blob content.
+
+        Returns:
+            tuple: The hex SHA-256 digest and the size of the blob in bytes.
+        """
+        raise NotImplementedError
+
+    def open(self, digest):
+        """Returns a readable binary file object for the blob."""
+        raise NotImplementedError
+
+    def exists(self, digest):
+        """Returns True if a blob with the given digest is stored."""
+        raise NotImplementedError
+
+    def path(self, digest):
+        """
+        Returns a local filesystem path for the blob, or None if the backend
+        cannot expose one. Serving from a path lets the WSGI server use a
+        zero-copy file wrapper (sendfile) instead of reading into Python.
+        """
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Stores blobs as files under a local directory, sharded by digest prefix."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        target = self._path(digest)
+
+        # Content-addressed: an existing file already holds these exact bytes
+        if not os.path.exists(target):
+            directory = os.path.dirname(target)
+            os.makedirs(directory, exist_ok=True)
+
+            # Write to a temporary file and rename it, so readers never see a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(data)
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                os.replace(tmp_path, target)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        return digest, len(data)
+
+    def open(self, digest):
+        return open(self._path(digest), "rb")
+
+    def exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def path(self, digest):
+        return self._path(digest)
+
+
+# Available storage backends, selected with the BLOB_STORE_BACKEND setting
+BLOB_STORE_BACKENDS = {
+    "local": LocalBlobStore,
+}
+
+
+def init_blob_store(app):
+    """
+    Creates the configured blob store and attaches it to the app.
+
+    Args:
+        app (Flask): The application to configure.
+    """
+    app.config.setdefault("BLOB_STORE_BACKEND", "local")
+    app.config.setdefault("BLOB_STORE_PATH", os.path.join(app.instance_path, "blobs"))
+
+    backend = BLOB_STORE_BACKENDS[app.config["BLOB_STORE_BACKEND"]]
+    app.extensions["blob_store"] = backend(app.config["BLOB_STORE_PATH"])
+
+
+def get_blob_store():
+    """Returns the blob store of the current application."""
+    return current_app.extensions["blob_store"]
+
+
+def send_blob(digest, mimetype):
+    """
+    Sends a stored blob as the response body.
+
+    When the backend exposes a local path, the file is handed to send_file by
+    path so the WSGI server can stream it with sendfile; otherwise the blob is
+    streamed from its file object. Conditional handling is left to the caller.
+
+    Args:
+        digest (str): The blob's hex SHA-256 digest.
+        mimetype (str): The Content-Type of the response.
+
+    Returns:
+        Response: The response streaming the blob.
+    """
+    store = get_blob_store()
+    blob_path = store.path(digest)
+    source = blob_path if blob_path else store.open(digest)
+    return send_file(source, mimetype=mimetype, conditional=False, etag=False)
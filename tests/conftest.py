@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+
+# The database is configured as soon as routes is imported, by any test module or fixture,
+# so DATABASE_URL must point at a throwaway file before the tests are even collected
+INSTANCE = tempfile.mkdtemp(prefix="imageshare-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(INSTANCE, 'database.db')}"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(INSTANCE, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def app():
+    """
+    The application, on a throwaway SQLite database and blob store.
+
+    Background threads and caches are turned off so every request hits the
+    database directly and nothing outlives the test session.
+    """
+    from app import app
+    from storage import init_blob_store
+
+    app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        IMAGE_WORKERS=0,
+        VOTE_BUFFER_ENABLED=False,
+        FRAGMENT_CACHE_ENABLED=False,
+        MAIL_SENDER_ENABLED=False,
+        BLOB_STORE_PATH=os.path.join(INSTANCE, "blobs"),
+    )
+    init_blob_store(app)
+    return app
+
+
+
+@pytest.fixture(scope="session")
+def log_in():
+    """Returns a function that signs a test client in as a user, or out when user_id is None."""
+    def log_in(client, user_id):
+        with client.session_transaction() as session:
+            session.clear()
+            if user_id is not None:
+                session["_user_id"] = str(user_id)
+                session["_fresh"] = True
+    return log_in
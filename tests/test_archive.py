@@ -0,0 +1,75 @@
+import io
+import json
+import tarfile
+
+from sqlalchemy import insert, select
+
+from archive import read_archive, write_archive
+from models import db, Comment, Image, User
+from search import search_images
+from storage import get_blob_store
+
+
+# Key columns of the main archived tables, in a stable order
+def _catalog(connection):
+    return {
+        "user": connection.execute(select(User.id, User.username, User.email).order_by(User.id)).all(),
+        "image": connection.execute(select(Image.id, Image.name, Image.content_hash).order_by(Image.id)).all(),
+        "comment": connection.execute(select(Comment.id, Comment.content).order_by(Comment.id)).all(),
+    }
+
+
+# Rows of one table in an archive, read back from its NDJSON chunks
+def _archived_rows(data, table):
+    rows = []
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r|") as tar:
+        for member in tar:
+            if member.name.startswith(f"tables/{table}/"):
+                rows += [json.loads(line) for line in tar.extractfile(member).read().splitlines()]
+    return rows
+
+
+def test_export_then_import_restores_the_catalog(app):
+    with app.app_context():
+        artist_id = User.query.filter_by(username="artist3").first().id
+        digest, size = get_blob_store().put(b"archived image bytes")
+        image = Image(name="Archived", user_id=artist_id, content_hash=digest, content_size=size,
+                      moderation_status="approved")
+        db.session.add(image)
+        db.session.flush()
+        db.session.add(Comment(content="Kept in the archive", user_id=artist_id, image_id=image.id))
+        db.session.commit()
+        before = _catalog(db.session)
+
+        archive = io.BytesIO()
+        counts = write_archive(archive, get_blob_store(), chunk_rows=2, compress=True, progress=lambda message: None)
+        assert counts["image"] == len(before["image"])
+        assert counts["blobs"] >= 1
+
+        read_counts = read_archive(io.BytesIO(archive.getvalue()), get_blob_store(), progress=lambda message: None)
+        assert {table: read_counts.get(table, 0) for table in counts} == counts
+        db.session.expire_all()
+        assert _catalog(db.session) == before
+        assert get_blob_store().exists(digest)
+
+        # The search index is rebuilt from the imported rows
+        assert [found.id for found in search_images("kept").items] == [image.id]
+
+
+def test_export_reads_one_snapshot(app):
+    with app.app_context():
+        artist_id = User.query.filter_by(username="artist3").first().id
+        inserted = []
+
+        # Commits an image from another connection once the user table is exported, before images are read
+        def insert_during_export(message):
+            if message.startswith("Exported") and "of user" in message and not inserted:
+                with db.engine.begin() as connection:
+                    result = connection.execute(insert(Image).values(name="Late", user_id=artist_id))
+                    inserted.append(result.inserted_primary_key[0])
+
+        archive = io.BytesIO()
+        write_archive(archive, get_blob_store(), progress=insert_during_export)
+
+        assert inserted
+        assert inserted[0] not in {row["id"] for row in _archived_rows(archive.getvalue(), "image")}
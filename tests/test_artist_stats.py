@@ -0,0 +1,25 @@
+from models import db, ArtistStats, Image, User
+from stats import rebuild_artist_stats
+
+
+def test_reset_votes_picks_the_next_top_image(app, log_in):
+    with app.app_context():
+        admin_id = User.query.filter_by(is_superuser=True).first().id
+        artist_id = User.query.filter_by(username="artist2").first().id
+        top = Image(name="Top", user_id=artist_id, moderation_status="approved", vote_count=3)
+        runner_up = Image(name="Runner up", user_id=artist_id, moderation_status="approved", vote_count=1)
+        db.session.add_all([top, runner_up])
+        db.session.flush()
+        rebuild_artist_stats(db.session, [artist_id])
+        db.session.commit()
+        top_id, runner_up_id = top.id, runner_up.id
+        assert db.session.get(ArtistStats, artist_id).top_image_id == top_id
+
+    client = app.test_client()
+    log_in(client, admin_id)
+    response = client.post(f"/reset_votes/{top_id}", data={"reset_reason": "Vote ring"})
+    assert response.status_code == 302
+
+    with app.app_context():
+        stats = db.session.get(ArtistStats, artist_id)
+        assert (stats.top_image_id, stats.top_image_votes, stats.total_votes) == (runner_up_id, 1, 1)
@@ -0,0 +1,67 @@
+import pytest
+
+import routes
+from models import db, ArtistStats, Image, User
+
+
+@pytest.fixture
+def images(app):
+    with app.app_context():
+        artist_id = User.query.filter_by(username="artist4").first().id
+        images = [Image(name=f"Bulk {n}", user_id=artist_id, moderation_status="pending") for n in range(3)]
+        db.session.add_all(images)
+        db.session.commit()
+        return artist_id, [image.id for image in images]
+
+
+@pytest.fixture
+def admin(app, log_in):
+    client = app.test_client()
+    with app.app_context():
+        log_in(client, User.query.filter_by(is_superuser=True).first().id)
+    return client
+
+
+def test_json_request_approves_every_image(app, admin, images):
+    artist_id, image_ids = images
+    response = admin.post("/bulk_moderate", json={"image_ids": image_ids, "status": "approved", "category": "Art"})
+    assert response.get_json() == {"success": True, "updated": 3}
+
+    with app.app_context():
+        rows = Image.query.filter(Image.id.in_(image_ids)).all()
+        assert {(image.moderation_status, image.category) for image in rows} == {("approved", "Art")}
+        assert len({image.unique_number for image in rows}) == 3 and all(image.unique_number for image in rows)
+        assert db.session.get(ArtistStats, artist_id).approved_count >= 3
+
+
+@pytest.mark.parametrize("body", [
+    [1, 2],
+    {"image_ids": "12", "status": "approved"},
+    {"image_ids": [True], "status": "approved"},
+    {"image_ids": [1], "status": ["approved"]},
+    {"image_ids": [1], "archived": "yes"},
+    {"image_ids": [], "status": "approved"},
+    {"image_ids": [10 ** 9], "status": "approved"},
+])
+def test_invalid_json_requests_get_400(admin, body):
+    response = admin.post("/bulk_moderate", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+def test_form_with_bad_ids_changes_nothing(app, admin, images):
+    _, image_ids = images
+    response = admin.post("/bulk_moderate", data={"image_ids": [str(image_ids[0]), "x"], "status": "approved"})
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert db.session.get(Image, image_ids[0]).moderation_status == "pending"
+
+
+def test_internal_errors_are_not_reported_as_bad_requests(admin, images, monkeypatch):
+    def broken(*args, **kwargs):
+        raise TypeError("a bug")
+
+    monkeypatch.setattr(routes, "bulk_moderate", broken)
+    with pytest.raises(TypeError):
+        admin.post("/bulk_moderate", json={"image_ids": images[1], "status": "approved"})
@@ -0,0 +1,191 @@
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from mailer import SMTPConnection, claim_emails, send_due_emails
+from models import db, OutboxEmail
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib: accepts every message except to refused recipients."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        self.reply("220 stub ready")
+        recipients = []
+        for raw in self.rfile:
+            command = raw.decode("ascii").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 stub")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                if address in server.refused:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                server.delivered.extend(recipients)
+                self.reply("250 Queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            else:
+                self.reply("502 Not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.delivered = []  # Recipients of every accepted message
+        self.refused = set()  # Recipients answered with 550
+
+
+@pytest.fixture
+def smtp_server():
+    server = _SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def config(app, smtp_server):
+    config = dict(app.config)
+    config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=smtp_server.server_address[1], MAIL_USE_TLS=False,
+                  MAIL_USERNAME=None, MAIL_SENDER="noreply@example.com", MAIL_TIMEOUT=5,
+                  MAIL_BATCH_SIZE=10, MAIL_CLAIM_SECONDS=300, MAIL_MAX_ATTEMPTS=3, MAIL_RETRY_BASE_SECONDS=30)
+    return config
+
+
+@pytest.fixture
+def connection(config):
+    connection = SMTPConnection(config)
+    yield connection
+    connection.close()
+
+
+# Empties the outbox and queues one email per recipient, returning their ids
+@pytest.fixture
+def queue(app):
+    def queue(*recipients):
+        with app.app_context():
+            emails = [OutboxEmail(recipient=recipient, subject="Hello", body="Hi there") for recipient in recipients]
+            db.session.add_all(emails)
+            db.session.commit()
+            return [email.id for email in emails]
+
+    with app.app_context():
+        OutboxEmail.query.delete()
+        db.session.commit()
+    return queue
+
+
+def _email(email_id):
+    db.session.expire_all()
+    return db.session.get(OutboxEmail, email_id)
+
+
+def test_due_emails_are_delivered_over_one_connection(app, smtp_server, config, connection, queue):
+    first, second = queue("one@example.com", "two@example.com")
+    with app.app_context():
+        assert send_due_emails(connection, config) == 2
+        assert send_due_emails(connection, config) == 0
+
+        for email_id in (first, second):
+            email = _email(email_id)
+            assert (email.status, email.attempts, email.claimed_until) == ("sent", 1, None)
+            assert email.sent_at is not None
+    assert smtp_server.delivered == ["one@example.com", "two@example.com"]
+
+
+def test_failed_emails_are_retried_with_backoff_then_given_up(app, smtp_server, config, connection, queue):
+    email_id, = queue("nobody@example.com")
+    smtp_server.refused.add("nobody@example.com")
+    with app.app_context():
+        for attempt, delay in ((1, 30), (2, 60)):
+            before = datetime.utcnow()
+            assert send_due_emails(connection, config) == 1
+            email = _email(email_id)
+            assert (email.status, email.attempts, email.claimed_until) == ("pending", attempt, None)
+            assert "No such user" in email.last_error
+            assert before + timedelta(seconds=delay) <= email.next_attempt_at <= datetime.utcnow() + timedelta(seconds=delay)
+
+            # Not due again before its delay has passed
+            assert send_due_emails(connection, config) == 0
+            email.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+
+        assert send_due_emails(connection, config) == 1
+        assert _email(email_id).status == "failed"
+        assert send_due_emails(connection, config) == 0
+    assert smtp_server.delivered == []
+
+
+def test_a_retried_email_is_delivered(app, smtp_server, config, connection, queue):
+    email_id, = queue("later@example.com")
+    smtp_server.refused.add("later@example.com")
+    with app.app_context():
+        send_due_emails(connection, config)
+        smtp_server.refused.clear()
+        _email(email_id).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        assert send_due_emails(connection, config) == 1
+        email = _email(email_id)
+        assert (email.status, email.attempts, email.last_error) == ("sent", 2, None)
+    assert smtp_server.delivered == ["later@example.com"]
+
+
+def test_claimed_emails_are_sent_again_once_the_claim_expires(app, smtp_server, config, connection, queue):
+    email_id, = queue("orphan@example.com")
+    with app.app_context():
+        # Another process claims the email, then dies before sending it
+        assert [row.id for row in claim_emails(10, 300)] == [email_id]
+        assert send_due_emails(connection, config) == 0
+
+        _email(email_id).claimed_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert send_due_emails(connection, config) == 1
+        email = _email(email_id)
+        assert (email.status, email.attempts) == ("sent", 2)
+    assert smtp_server.delivered == ["orphan@example.com"]
+
+
+def test_an_unexpected_error_does_not_undo_the_emails_already_sent(app, smtp_server, config, connection, queue):
+    sent_id, broken_id, later_id = queue("one@example.com", "broken@example.com", "two@example.com")
+
+    class BrokenConnection:
+        def send(self, recipient, message):
+            if recipient == "broken@example.com":
+                raise RuntimeError("Unexpected")
+            connection.send(recipient, message)
+
+        def close(self):
+            connection.close()
+
+    with app.app_context():
+        assert send_due_emails(BrokenConnection(), config) == 3
+        assert [_email(email_id).status for email_id in (sent_id, broken_id, later_id)] == ["sent", "pending", "sent"]
+        assert _email(broken_id).last_error == "Unexpected"
+    assert smtp_server.delivered == ["one@example.com", "two@example.com"]
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from models import db, Image, User
+from pagination import decode_cursor, encode_cursor, keyset_page, merged_keyset_page
+
+
+ORDER = [Image.upload_date, Image.id]
+
+
+def test_merged_pages_match_a_single_query(app):
+    with app.app_context():
+        artist_id = User.query.filter_by(username="artist4").first().id
+        db.session.add_all([Image(name=f"Merged {n}", user_id=artist_id, moderation_status=status)
+                            for n, status in enumerate(["pending", "approved", "unmoderated"] * 3)])
+        db.session.commit()
+
+        statuses = ["pending", "approved"]
+        expected = [image.id for image in keyset_page(
+            Image.query.filter(Image.moderation_status.in_(statuses)), ORDER, per_page=1000).items]
+
+        seen, cursor = [], None
+        while True:
+            queries = [Image.query.filter(Image.moderation_status == status) for status in statuses]
+            page = merged_keyset_page(queries, ORDER, cursor=cursor, per_page=2)
+            seen += [image.id for image in page.items]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        assert seen == expected
+
+
+def test_cursor_values_must_match_their_column_types(app, log_in):
+    with app.app_context():
+        assert decode_cursor(encode_cursor([datetime(2024, 5, 1), 7]), ORDER) == [datetime(2024, 5, 1), 7]
+        assert decode_cursor(encode_cursor([3, 7]), [Image.hot_score, Image.id]) == [3.0, 7]
+        for values in ([{"a": 1}, 7], [[1], 7], ["2024-05-01", "7"], ["2024-05-01", True], [None, 7]):
+            assert decode_cursor(encode_cursor(values), ORDER) is None
+
+    client = app.test_client()
+    log_in(client, None)
+    crafted = encode_cursor([{"a": 1}, [2]])
+    for path in ["/guest_view", "/guest_view?sort=hot", "/guest_view?sort=top", "/profile/2/followers.json"]:
+        separator = "&" if "?" in path else "?"
+        assert client.get(f"{path}{separator}cursor={crafted}").status_code == 200
@@ -0,0 +1,137 @@
+import io
+import re
+from datetime import datetime
+
+import pytest
+from PIL import Image as PILImage
+from sqlalchemy import event
+
+from models import db, Image, User
+from pagination import encode_cursor
+
+
+# Plan lines of a full table scan, e.g. "SCAN image" (or "SCAN TABLE image" before SQLite 3.36)
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(\w+)$")
+
+# Plan line of a sort of every matching row, which keyset pages must avoid by reading an index in order
+TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+# Pages ordered by a value computed per request (search relevance), which no index can hold
+COMPUTED_ORDER_PAGES = ("/search",)
+
+# Plan lines of a subquery SQLite evaluates first; scanning its result reads no table
+SUBQUERY = re.compile(r"^(MATERIALIZE|CO-ROUTINE) (\w+)$")
+
+CURSOR = encode_cursor([datetime.utcnow(), 0])
+
+# Pages whose queries must stay on indexes, with the account they are requested as.
+# {image} and {artist} are filled in with the seeded approved image and its uploader.
+PAGES = [
+    ("GET", "/superuser_dashboard", "admin"),
+    ("GET", "/superuser_dashboard?category=Nature&cursor=" + CURSOR, "admin"),
+    ("GET", "/edit_images", "admin"),
+    ("GET", "/edit_images?category=Nature", "admin"),
+    ("GET", "/archived_images", "admin"),
+    ("GET", "/archived_images?category=Nature&cursor=" + CURSOR, "admin"),
+    ("GET", "/superuser_dashboard/duplicates", "admin"),
+    ("GET", "/view_all_images", "admin"),
+    ("GET", "/view_all_images?category=Nature&cursor=" + CURSOR, "admin"),
+    ("GET", "/view_all_images?sort=top", "admin"),
+    ("GET", "/view_all_images?sort=top&category=Nature&cursor=" + encode_cursor([2 ** 31, 0]), "admin"),
+    ("GET", "/guest_view", None),
+    ("GET", "/guest_view?category=Nature&cursor=" + CURSOR, None),
+    ("GET", "/guest_view?sort=hot", None),
+    ("GET", "/guest_view?sort=hot&category=Nature&cursor=" + encode_cursor([1e9, 0]), None),
+    ("GET", "/search?q=sun&category=Nature&cursor=" + encode_cursor([1e9, 0]), "admin"),
+    ("GET", "/profile", "artist"),
+    ("GET", "/profile/{artist}", "admin"),
+    ("GET", "/profile/{artist}/followers.json?cursor=" + encode_cursor([2 ** 31]), None),
+    ("GET", "/image/{image}/comments", "admin"),
+    ("GET", "/image/{image}/comments.json?cursor=" + CURSOR, None),
+    ("GET", "/user/{artist}/images.zip", "admin"),
+    ("POST", "/vote/{image}/upvote", "admin"),
+    ("POST", "/vote/{image}/downvote", "admin"),
+]
+
+
+def png(color):
+    """Returns a small PNG of a solid colour with a stripe, so each upload hashes differently."""
+    picture = PILImage.new("RGB", (64, 48), color)
+    picture.paste((255, 255, 255), (0, 0, 64, 12))
+    buffer = io.BytesIO()
+    picture.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def seeded(app, log_in):
+    """
+    Uploads, approves, comments on, votes for and follows through the app's
+    own routes, so every listing has rows to return.
+
+    Returns:
+        dict: The ids of the superuser, the artist and the approved image.
+    """
+    client = app.test_client()
+    with app.app_context():
+        admin_id = User.query.filter_by(is_superuser=True).first().id
+        artist_id = User.query.filter_by(username="artist1").first().id
+
+    log_in(client, artist_id)
+    for name, color in [("Sunset on the beach", (250, 120, 40)), ("Forest", (20, 120, 40))]:
+        response = client.post("/upload_image", data={"name": name, "image": (io.BytesIO(png(color)), "a.png")})
+        assert response.status_code == 302
+
+    with app.app_context():
+        image_id = Image.query.filter_by(user_id=artist_id).order_by(Image.id).first().id
+
+    log_in(client, admin_id)
+    requests = [
+        (f"/moderate_image/{image_id}", {"status": "approved", "category": "Nature"}),
+        (f"/follow/{artist_id}", {}),
+        (f"/image/{image_id}/comments", {"content": "Sunny and bright"}),
+        (f"/vote/{image_id}/upvote", {}),
+    ]
+    for path, data in requests:
+        assert client.post(path, data=data).status_code < 400, path
+
+    with app.app_context():
+        assert db.session.get(Image, image_id).moderation_status == "approved"
+    return {"admin": admin_id, "artist": artist_id, "image": image_id}
+
+
+@pytest.mark.parametrize("method, path, account", PAGES)
+def test_page_uses_indexes(app, seeded, log_in, method, path, account):
+    path = path.format(**seeded)
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            statements.setdefault(statement, parameters)
+
+    client = app.test_client()
+    log_in(client, seeded[account] if account else None)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.open(path, method=method)
+        response.get_data()  # Streamed responses only run their queries as they are read
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+    assert response.status_code < 400
+    assert statements
+
+    scans = []
+    with app.app_context(), db.engine.connect() as conn:
+        for statement, parameters in statements.items():
+            plan = [row.detail for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+            subqueries = {match.group(2) for match in map(SUBQUERY.match, plan) if match}
+            scans += [f"{detail}: {' '.join(statement.split())}" for detail in plan
+                      if (match := FULL_SCAN.match(detail)) and match.group(2) not in subqueries
+                      or detail == TEMP_SORT and not path.startswith(COMPUTED_ORDER_PAGES)]
+    assert not scans, "\n".join(scans)
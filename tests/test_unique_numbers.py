@@ -0,0 +1,60 @@
+import pytest
+
+from models import db, Image, User
+from unique_numbers import DIGITS, HALF, ROUNDS, _permutation_key, _round, allocate_unique_numbers, permute, reserve_sequence
+
+
+# Runs the Feistel network backwards, which only works if every round is a bijection
+def _unpermute(number, key):
+    left, right = divmod(int(number), HALF)
+    for round_number in reversed(range(ROUNDS)):
+        left, right = (right - _round(key, round_number, left)) % HALF, left
+    return left * HALF + right
+
+
+def test_permutation_is_a_bijection_on_ten_digits(app):
+    with app.app_context():
+        key = _permutation_key()
+    values = list(range(20000)) + [HALF - 1, HALF, HALF * HALF - 1] + list(range(12345678, HALF * HALF, 9876543))
+
+    numbers = [permute(value, key) for value in values]
+    assert len(set(numbers)) == len(values)
+    assert all(len(number) == DIGITS and number.isdigit() for number in numbers)
+    assert [_unpermute(number, key) for number in numbers] == values
+
+
+def test_consecutive_values_give_scattered_numbers(app):
+    with app.app_context():
+        key = _permutation_key()
+    numbers = [int(permute(value, key)) for value in range(100)]
+    assert numbers != sorted(numbers)
+    assert permute(0, key) != permute(0, b"another key")
+
+
+def test_reserved_ranges_are_disjoint_and_exhaustion_is_reported(app):
+    with app.app_context():
+        try:
+            first = reserve_sequence(3)
+            second = reserve_sequence(5)
+            assert (len(first), len(second)) == (3, 5)
+            assert second.start == first.stop
+
+            with pytest.raises(RuntimeError):
+                reserve_sequence(HALF * HALF)
+        finally:
+            db.session.rollback()
+
+
+def test_numbers_already_held_by_images_are_skipped(app):
+    with app.app_context():
+        key = _permutation_key()
+        try:
+            start = reserve_sequence(1).stop
+            artist_id = User.query.filter_by(username="artist1").first().id
+            db.session.add(Image(name="Numbered", user_id=artist_id, unique_number=permute(start + 1, key)))
+            db.session.flush()
+
+            numbers = allocate_unique_numbers(3)
+            assert numbers == [permute(value, key) for value in (start, start + 2, start + 3)]
+        finally:
+            db.session.rollback()
@@ -0,0 +1,41 @@
+from sqlalchemy import event
+
+from models import db, User
+from user_cache import invalidate_user_cache, load_cached_user
+
+
+def test_cache_hit_runs_no_sql(app):
+    with app.test_request_context():
+        user_id = User.query.filter_by(username="artist5").first().id
+        load_cached_user(user_id)
+
+        statements = []
+        record = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            user = load_cached_user(user_id)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        assert user.username == "artist5"
+        assert statements == []
+
+
+def test_change_is_seen_once_committed(app):
+    with app.test_request_context():
+        user_id = User.query.filter_by(username="artist5").first().id
+        old_email = load_cached_user(user_id).email
+
+        # The change is made but not yet committed
+        db.session.get(User, user_id).email = "artist5-new@example.com"
+        invalidate_user_cache()
+        db.session.flush()
+
+        # A concurrent request in this process still reads the committed user
+        with app.test_request_context():
+            assert load_cached_user(user_id).email == old_email
+
+        db.session.commit()
+
+        with app.test_request_context():
+            assert load_cached_user(user_id).email == "artist5-new@example.com"
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import event
+
+from database import RoutingSession
+from models import db, Image, User, Vote
+from votes import VoteBuffer
+
+
+@pytest.fixture
+def image_id(app):
+    with app.app_context():
+        artist_id = User.query.filter_by(username="artist5").first().id
+        image = Image(name="Buffered", user_id=artist_id, moderation_status="approved", vote_count=0)
+        db.session.add(image)
+        db.session.commit()
+        return image.id
+
+
+# A buffer whose thread never flushes on its own during a test
+@pytest.fixture
+def buffer(app):
+    buffer = VoteBuffer(app, flush_interval=3600, max_staleness=3600)
+    yield buffer
+    buffer.close()
+
+
+def _voter_ids(app, count):
+    with app.app_context():
+        return [user.id for user in User.query.order_by(User.id).limit(count)]
+
+
+def test_votes_are_projected_then_written(app, buffer, image_id):
+    first, second = _voter_ids(app, 2)
+    with app.app_context():
+        assert buffer.vote(first, image_id, "upvote") == (1, "upvote")
+        assert buffer.vote(second, image_id, "upvote") == (2, "upvote")
+        assert buffer.vote(second, image_id, "upvote") == (1, None)
+        assert db.session.get(Image, image_id).vote_count == 0
+
+        buffer.flush()
+        db.session.expire_all()
+        assert db.session.get(Image, image_id).vote_count == 1
+        assert Vote.query.filter_by(image_id=image_id).count() == 1
+        assert buffer.projected_count(image_id) == 1
+
+
+def test_counts_read_during_a_flush_are_not_doubled(app, buffer, image_id):
+    voter, = _voter_ids(app, 1)
+    with app.app_context():
+        buffer.vote(voter, image_id, "upvote")
+
+    # Reads the projected count from another request the moment the flush commits
+    counts, readers = [], []
+
+    def read_count():
+        with app.app_context():
+            counts.append(buffer.projected_count(image_id))
+
+    def on_commit(session):
+        reader = threading.Thread(target=read_count)
+        reader.start()
+        readers.append(reader)
+        time.sleep(0.05)
+
+    event.listen(RoutingSession, "after_commit", on_commit)
+    try:
+        buffer.flush()
+    finally:
+        event.remove(RoutingSession, "after_commit", on_commit)
+    for reader in readers:
+        reader.join()
+
+    assert counts == [1]
+
+
+def test_discarding_an_image_resets_the_staleness_clock(app, image_id):
+    first, second = _voter_ids(app, 2)
+    buffer = VoteBuffer(app, flush_interval=3600, max_staleness=0.2)
+    try:
+        with app.app_context():
+            buffer.vote(first, image_id, "upvote")
+            buffer.discard_image(image_id)
+            time.sleep(0.25)
+
+            # Only the vote just cast is pending, so it is not yet stale enough to force a flush
+            buffer.vote(second, image_id, "upvote")
+            assert Vote.query.filter_by(image_id=image_id).count() == 0
+    finally:
+        buffer.close()
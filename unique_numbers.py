@@ -0,0 +1,108 @@
+import hashlib
+import hmac
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from database import insert_if_absent
+from models import db, Image, UniqueNumberCounter
+
+
+# Unique numbers are 10 digits; the permutation splits them into two 5-digit halves
+DIGITS = 10
+HALF = 10 ** (DIGITS // 2)
+ROUNDS = 8
+
+# Name of the counter row that numbers images
+COUNTER_NAME = "image"
+
+
+# Derives the permutation key from the app's secret, so numbers cannot be predicted from the sequence
+def _permutation_key():
+    secret = current_app.config["SECRET_KEY"]
+    if isinstance(secret, str):
+        secret = secret.encode()
+    return hmac.new(secret, b"unique-number-permutation", hashlib.sha256).digest()
+
+
+# Feistel round function: a keyed hash of one half, reduced to a 5-digit value
+def _round(key, round_number, half):
+    digest = hmac.new(key, f"{round_number}:{half}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], "big") % HALF
+
+
+def permute(value, key):
+    """
+    Maps a sequence value to a unique number with a balanced Feistel network
+    over the 10-digit range.
+
+    Each round replaces one half with the other plus a keyed hash, modulo
+    10^5, so every round and therefore the whole network is a bijection on
+    0..10^10-1: distinct sequence values always give distinct numbers, and
+    consecutive values give numbers that look random.
+
+    Args:
+        value (int): Sequence value, 0 <= value < 10^10.
+        key (bytes): Permutation key.
+
+    Returns:
+        str: The unique number, zero-padded to 10 digits.
+    """
+    left, right = divmod(value, HALF)
+    for round_number in range(ROUNDS):
+        left, right = right, (left + _round(key, round_number, right)) % HALF
+    return str(left * HALF + right).zfill(DIGITS)
+
+
+def reserve_sequence(count):
+    """
+    Reserves count consecutive sequence values with one atomic UPDATE.
+
+    The counter is advanced and read back in the same statement, which holds
+    the database's write lock on it until the transaction ends, so
+    concurrent moderators in other processes always get disjoint ranges.
+    Does not commit.
+
+    Returns:
+        range: The reserved sequence values.
+    """
+    db.session.execute(insert_if_absent(db.engine, UniqueNumberCounter, ["name"], name=COUNTER_NAME, next_value=0))
+    end = db.session.execute(
+        update(UniqueNumberCounter)
+        .where(UniqueNumberCounter.name == COUNTER_NAME)
+        .values(next_value=UniqueNumberCounter.next_value + count)
+        .returning(UniqueNumberCounter.next_value),
+        execution_options={"synchronize_session": False},
+    ).scalar_one()
+    if end > HALF * HALF:
+        raise RuntimeError("All 10-digit unique numbers have been issued")
+    return range(end - count, end)
+
+
+def allocate_unique_numbers(count):
+    """
+    Issues count new unique numbers.
+
+    Numbers come from reserved sequence values, so they never collide with
+    each other or with numbers issued concurrently. Images numbered at
+    random by earlier versions (or under another SECRET_KEY) may still hold
+    some of them; those are found with one query and replaced from a
+    further reservation. Does not commit.
+
+    Returns:
+        list: The unique numbers, as 10-digit strings.
+    """
+    key = _permutation_key()
+    numbers = []
+    while len(numbers) < count:
+        candidates = [permute(value, key) for value in reserve_sequence(count - len(numbers))]
+        taken = set(db.session.execute(
+            select(Image.unique_number).where(Image.unique_number.in_(candidates))
+        ).scalars())
+        numbers += [number for number in candidates if number not in taken]
+    return numbers
+
+
+def allocate_unique_number():
+    """Issues a single new unique number. Does not commit."""
+    return allocate_unique_numbers(1)[0]
@@ -0,0 +1,154 @@
+import time
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event, select, update
+
+from cache import MemoryCacheBackend
+from database import RoutingSession, insert_if_absent
+from models import db, CacheGeneration, User
+
+
+# Name of the generation counter of the user cache
+GENERATION_NAME = "users"
+
+# User columns kept in the cache: everything the navigation and permission checks read
+SESSION_FIELDS = ("id", "username", "email", "is_superuser", "is_verified")
+
+
+class CachedUser(UserMixin):
+    """
+    The signed-in user, built from the cached session fields.
+
+    Reading any other attribute (e.g. follower_count, images or
+    set_password) loads the full User row once for the request and reads it
+    from there, so routes can treat it like a User. That load is a query, so
+    pages that show more than the session fields should load the User they
+    render explicitly rather than rely on the fallback.
+    """
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not cached
+        if name.startswith("__"):
+            raise AttributeError(name)
+        user = self.__dict__.get("_user")
+        if user is None:
+            user = db.session.get(User, self.id)
+            if user is None:
+                raise AttributeError(name)
+            self.__dict__["_user"] = user
+        return getattr(user, name)
+
+
+def init_user_cache(app):
+    """
+    Creates the user cache of an app.
+
+    Settings:
+        USER_CACHE_ENABLED: Cache signed-in users between requests.
+        USER_CACHE_TTL: Seconds a cached user is reused.
+        USER_CACHE_MAX_ENTRIES: Users kept before the least recently used are evicted.
+        USER_CACHE_GENERATION_TTL: Seconds the generation read from the
+            database is reused, i.e. how long a change made by another
+            process may take to be seen.
+    """
+    app.config.setdefault("USER_CACHE_ENABLED", True)
+    app.config.setdefault("USER_CACHE_TTL", 300)
+    app.config.setdefault("USER_CACHE_MAX_ENTRIES", 10000)
+    app.config.setdefault("USER_CACHE_GENERATION_TTL", 2)
+    app.extensions["user_cache"] = UserCache(app.config["USER_CACHE_MAX_ENTRIES"],
+                                             app.config["USER_CACHE_GENERATION_TTL"])
+
+
+class UserCache:
+    """
+    Cached session fields per user, plus this process's copy of the
+    generation counter they are keyed by.
+
+    The generation is read from the database at most once every
+    generation_ttl seconds, so a cache hit runs no SQL at all.
+    """
+
+    def __init__(self, max_entries, generation_ttl):
+        self.entries = MemoryCacheBackend(max_entries)
+        self.generation_ttl = generation_ttl
+        self._generation = (0, float("-inf"))  # Value and when it was read
+
+    def generation(self):
+        """Returns the generation, reading it from the database when this process's copy is too old."""
+        value, read_at = self._generation
+        now = time.monotonic()
+        if now - read_at >= self.generation_ttl:
+            value = db.session.execute(
+                select(CacheGeneration.value).where(CacheGeneration.name == GENERATION_NAME)
+            ).scalar() or 0
+            self._generation = (value, now)
+        return value
+
+    def expire_generation(self):
+        """Makes the next lookup read the generation from the database again."""
+        self._generation = (self._generation[0], float("-inf"))
+
+
+def load_cached_user(user_id):
+    """
+    Returns the user for Flask-Login, from the cache when it is current.
+
+    Cached users are keyed by the generation stored in the database, which
+    every change to a session field bumps in the same transaction. Each
+    process re-reads it at most every USER_CACHE_GENERATION_TTL seconds, so
+    a cache hit runs no query, and a bump from any worker process makes
+    every process reload its users within that time. The process that made
+    the change re-reads it on its next request.
+
+    Returns:
+        CachedUser: The user, or None if no such user exists.
+    """
+    if not current_app.config["USER_CACHE_ENABLED"]:
+        return db.session.get(User, user_id)
+
+    cache = current_app.extensions["user_cache"]
+    key = f"{user_id}@{cache.generation()}"
+    fields = cache.entries.get(key)
+    if fields is None:
+        row = db.session.execute(
+            select(*(getattr(User, field) for field in SESSION_FIELDS)).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        fields = row._asdict()
+        cache.entries.set(key, fields, current_app.config["USER_CACHE_TTL"])
+    return CachedUser(fields)
+
+
+def invalidate_user_cache():
+    """
+    Makes every process drop its cached users once the current transaction
+    commits: this one on its next request, the others within
+    USER_CACHE_GENERATION_TTL seconds. Call it with any change to a user's
+    email, password, verification or superuser status. Does not commit.
+    """
+    db.session.execute(insert_if_absent(db.engine, CacheGeneration, ["name"], name=GENERATION_NAME, value=0))
+    db.session.execute(
+        update(CacheGeneration)
+        .where(CacheGeneration.name == GENERATION_NAME)
+        .values(value=CacheGeneration.value + 1),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.info["expire_user_cache"] = True
+
+
+# Re-reads the generation only once the bump is committed. Expiring it earlier would let a
+# concurrent request re-read the old value and keep it, with stale users, for the whole TTL.
+@event.listens_for(RoutingSession, "after_commit")
+def _expire_after_commit(session):
+    if session.info.pop("expire_user_cache", False):
+        current_app.extensions["user_cache"].expire_generation()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_expiry(session):
+    session.info.pop("expire_user_cache", None)
@@ -0,0 +1,290 @@
+import atexit
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+
+from database import insert_if_absent
+from models import db, Image, Vote
+from ranking import set_hot_score
+from stats import record_vote_change
+
+
+# Contribution of each vote type to Image.vote_count
+VOTE_VALUES = {"upvote": 1, "downvote": -1}
+
+
+def write_vote(user_id, image_id, vote_type):
+    """
+    Sets a user's vote on an image to vote_type, or removes it with None.
+
+    Each branch is a single conditional statement on the (user_id, image_id)
+    unique index, and the statement's rowcount says whether it took effect,
+    so concurrent requests can neither create duplicate rows nor count the
+    same change twice. Does not commit.
+
+    Args:
+        user_id (int): The voter.
+        image_id (int): The image voted on.
+        vote_type (str): 'upvote', 'downvote' or None to remove the vote.
+
+    Returns:
+        int: The change this made to the image's vote count.
+    """
+    if vote_type is None:
+        removed = db.session.execute(
+            delete(Vote).where(Vote.user_id == user_id, Vote.image_id == image_id).returning(Vote.vote_type),
+            execution_options={"synchronize_session": False},
+        ).scalar()
+        return -VOTE_VALUES.get(removed, 0)
+
+    value = VOTE_VALUES[vote_type]
+
+    # Switch an opposite vote
+    switched = db.session.execute(
+        update(Vote)
+        .where(Vote.user_id == user_id, Vote.image_id == image_id, Vote.vote_type != vote_type)
+        .values(vote_type=vote_type, created_at=datetime.utcnow()),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if switched:
+        return 2 * value
+
+    # Or cast a new one; the (user_id, image_id) unique index leaves a vote of the same type already present alone
+    inserted = db.session.execute(insert_if_absent(
+        db.engine, Vote, ["user_id", "image_id"],
+        user_id=user_id, image_id=image_id, vote_type=vote_type, created_at=datetime.utcnow(),
+    )).rowcount
+    return value if inserted else 0
+
+
+def add_to_vote_count(image_id, delta):
+    """
+    Atomically adds delta to an image's vote count and returns the new count.
+    Also updates the image's hot score and, for votes on approved images,
+    the artist's stats. Does not commit.
+    """
+    if delta == 0:
+        return db.session.execute(select(Image.vote_count).where(Image.id == image_id)).scalar() or 0
+
+    new_count, upload_date, user_id, status = db.session.execute(
+        update(Image)
+        .where(Image.id == image_id)
+        .values(vote_count=func.coalesce(Image.vote_count, 0) + delta)
+        .returning(Image.vote_count, Image.upload_date, Image.user_id, Image.moderation_status),
+        execution_options={"synchronize_session": False},
+    ).one()
+    set_hot_score(image_id, new_count, upload_date)
+    if status == "approved":
+        record_vote_change(user_id, image_id, delta, new_count)
+    return new_count
+
+
+def toggle_vote(user_id, image_id, vote_type):
+    """
+    Applies a click on the upvote or downvote button.
+
+    Clicking the type the user already voted removes the vote; otherwise the
+    vote is cast or switched. The cost is a constant number of indexed
+    statements, independent of how many votes the image has. Does not commit.
+
+    Returns:
+        tuple: The image's new vote count and the user's vote afterwards.
+    """
+    # Removing first means a repeated click never needs to read the current vote
+    removed = db.session.execute(
+        delete(Vote).where(Vote.user_id == user_id, Vote.image_id == image_id, Vote.vote_type == vote_type),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if removed:
+        return add_to_vote_count(image_id, -VOTE_VALUES[vote_type]), None
+
+    delta = write_vote(user_id, image_id, vote_type)
+    return add_to_vote_count(image_id, delta), vote_type
+
+
+class VoteBuffer:
+    """
+    Write-behind buffer that coalesces vote clicks into batched flushes.
+
+    Clicks update an in-memory map of the latest vote state per (user, image)
+    and are answered at once with a projected count: the stored count plus
+    the changes not yet written. A background thread writes the net result
+    of all buffered clicks in one transaction every flush interval, so a
+    burst of toggles on a popular image costs one write transaction instead
+    of one per click.
+
+    Flushes work out each change from the rows actually in the database, so
+    several processes may each run their own buffer safely. Their projected
+    counts only include their own pending clicks.
+    """
+
+    def __init__(self, app, flush_interval, max_staleness):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_staleness = max_staleness
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # (user_id, image_id) -> vote type or None, not yet flushed
+        self._deltas = defaultdict(int)  # image_id -> projected change of pending votes
+        self._inflight = {}  # Votes of the flush in progress
+        self._inflight_deltas = defaultdict(int)
+        self._buffered_at = {}  # (user_id, image_id) -> when its pending vote was first buffered
+        self._oldest = None  # When the oldest pending vote was buffered
+        self._flushes = 0  # Flushes committed so far, so a count read across a commit can be retried
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="vote-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _current_vote(self, user_id, image_id):
+        key = (user_id, image_id)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if key in self._inflight:
+                return self._inflight[key]
+        return db.session.execute(
+            select(Vote.vote_type).where(Vote.user_id == user_id, Vote.image_id == image_id)
+        ).scalar()
+
+    def vote(self, user_id, image_id, vote_type):
+        """
+        Buffers a click on the upvote or downvote button.
+
+        Returns:
+            tuple: The projected vote count and the user's vote afterwards.
+        """
+        current = self._current_vote(user_id, image_id)
+
+        with self._lock:
+            # Another click from the same user may have been buffered meanwhile
+            current = self._pending.get((user_id, image_id), current)
+            new_vote = None if current == vote_type else vote_type
+            self._pending[(user_id, image_id)] = new_vote
+            self._deltas[image_id] += VOTE_VALUES.get(new_vote, 0) - VOTE_VALUES.get(current, 0)
+            now = time.monotonic()
+            self._buffered_at.setdefault((user_id, image_id), now)
+            if self._oldest is None:
+                self._oldest = now
+            stale = time.monotonic() - self._oldest >= self.max_staleness
+
+        # The flush thread is behind; write now rather than serve staler counts
+        if stale:
+            self.flush()
+
+        return self.projected_count(image_id), new_vote
+
+    def projected_count(self, image_id):
+        """
+        Returns the stored vote count plus the changes still buffered.
+
+        A flush commits and clears its in-flight changes in one step under
+        the lock, so if no flush committed while the stored count was read,
+        the count and the buffered changes never overlap. Otherwise the
+        count is read again.
+        """
+        while True:
+            with self._lock:
+                flushes = self._flushes
+            stored = db.session.execute(select(Image.vote_count).where(Image.id == image_id)).scalar() or 0
+            with self._lock:
+                if self._flushes == flushes:
+                    return stored + self._deltas.get(image_id, 0) + self._inflight_deltas.get(image_id, 0)
+
+    def pending_votes(self, user_id, image_ids):
+        """Returns {image_id: vote type or None} for the user's buffered votes on the given images."""
+        image_ids = set(image_ids)
+        with self._lock:
+            merged = dict(self._inflight)
+            merged.update(self._pending)
+        return {image_id: vote_type for (voter_id, image_id), vote_type in merged.items()
+                if voter_id == user_id and image_id in image_ids}
+
+    def discard_image(self, image_id):
+        """Drops buffered votes on an image, e.g. when its votes are reset."""
+        with self._flush_lock, self._lock:
+            for key in [key for key in self._pending if key[1] == image_id]:
+                del self._pending[key]
+                del self._buffered_at[key]
+            self._deltas.pop(image_id, None)
+            self._oldest = min(self._buffered_at.values(), default=None)
+
+    def flush(self):
+        """Writes every buffered vote and the resulting count changes in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._inflight, self._pending = self._pending, {}
+                self._inflight_deltas, self._deltas = self._deltas, defaultdict(int)
+                self._buffered_at = {}
+                self._oldest = None
+
+            with self.app.app_context():
+                try:
+                    image_deltas = defaultdict(int)
+                    for (user_id, image_id), vote_type in self._inflight.items():
+                        image_deltas[image_id] += write_vote(user_id, image_id, vote_type)
+                    for image_id, delta in image_deltas.items():
+                        add_to_vote_count(image_id, delta)
+
+                    # The counts become visible and stop being projected in the same step
+                    with self._lock:
+                        db.session.commit()
+                        self._clear_inflight()
+                        self._flushes += 1
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Vote flush failed: {e}")
+                    self._requeue()
+                finally:
+                    db.session.remove()
+
+    def _clear_inflight(self):
+        self._inflight = {}
+        self._inflight_deltas = defaultdict(int)
+
+    # Puts the votes of a failed flush back, unless newer clicks replaced them
+    def _requeue(self):
+        with self._lock:
+            now = time.monotonic()
+            for key, vote_type in self._inflight.items():
+                self._pending.setdefault(key, vote_type)
+                self._buffered_at.setdefault(key, now)
+            for image_id, delta in self._inflight_deltas.items():
+                self._deltas[image_id] += delta
+            self._clear_inflight()
+            self._oldest = min(self._buffered_at.values(), default=None)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stops the flush thread and writes whatever is still buffered."""
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Returns the app's vote buffer, starting it on first use, or None if buffering is disabled."""
+    app = current_app._get_current_object()
+    if not app.config["VOTE_BUFFER_ENABLED"]:
+        return None
+    with _buffer_lock:
+        buffer = app.extensions.get("vote_buffer")
+        if buffer is None:
+            buffer = VoteBuffer(app, app.config["VOTE_BUFFER_FLUSH_MS"] / 1000,
+                                app.config["VOTE_BUFFER_MAX_STALENESS_MS"] / 1000)
+            app.extensions["vote_buffer"] = buffer
+    return buffer
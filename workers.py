@@ -0,0 +1,106 @@
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the pending queue is full."""
+
+
+class WorkerCrashed(Exception):
+    """Raised when a worker process died while the job was queued or running; the pool has been restarted."""
+
+
+class BoundedWorkerPool:
+    """
+    Runs CPU-bound jobs in a process pool with a bounded backlog.
+
+    At most max_workers jobs run at once and at most max_pending more may
+    wait for a worker. Further submissions fail immediately with
+    PoolSaturated instead of queueing without limit, so callers can shed
+    load. With max_workers set to 0 jobs run inline in the calling thread,
+    still subject to the same bound.
+
+    Workers are started with spawn rather than fork, since the app process
+    already runs background threads (vote buffer, mail sender) that a fork
+    would copy mid-flight. If a worker dies, e.g. killed for running out of
+    memory, the executor is replaced so later jobs run on fresh workers.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max(max_workers, 1) + max_pending)
+        self._executor_lock = threading.Lock()
+        self._executor = None
+        if max_workers > 0:
+            self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # Replaces a broken executor, unless another thread already has
+    def _restart(self, broken):
+        with self._executor_lock:
+            if self._executor is broken:
+                self._executor = self._new_executor()
+                broken.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, fn, *args, timeout=None):
+        """
+        Runs fn(*args) on a worker and waits for its result.
+
+        Raises:
+            PoolSaturated: If the pool's backlog is full.
+            WorkerCrashed: If a worker died before the job finished.
+            concurrent.futures.TimeoutError: If the job takes longer than timeout.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated()
+
+        if self._executor is None:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        executor = self._executor
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart(executor)
+            raise WorkerCrashed()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # The slot is freed when the job finishes, even if the caller stops waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise WorkerCrashed()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Returns the app's image worker pool, creating it on first use."""
+    app = current_app._get_current_object()
+    with _pool_lock:
+        pool = app.extensions.get("worker_pool")
+        if pool is None:
+            pool = BoundedWorkerPool(app.config["IMAGE_WORKERS"], app.config["IMAGE_QUEUE_SIZE"])
+            app.extensions["worker_pool"] = pool
+            atexit.register(pool.shutdown)
+    return pool